@@ -0,0 +1,439 @@
+"""基于本地替身服务 (mind_stub_server) 的端到端延迟基准。
+
+测量内容：
+  - 各阶段延迟：generating_sd (Trigger+Devil) 与 waiting_comfort (Guide+Strategist)，以及流式首字延迟
+  - Streamlit rerun 开销：waiting_comfort 阶段在不同历史长度下一次 rerun 的耗时 (不含 LLM 调用)
+  - 吞吐量：N 场会话并发运行时的 sessions/hour 与 rounds/s
+
+结果保存到 benchmarks/results/<git短哈希>[-label].json，可用 compare 子命令对比两次提交。
+ab 子命令用相同的会话起点分别运行四次调用 (split) 与合并调用 (fused) 两种模式，对比延迟、token 与输出质量指标。
+coldstart 子命令在新进程中测量界面模块的导入耗时 (python -X importtime，按顶层包汇总) 与首屏渲染耗时。
+
+用法:
+    python mind_benchmark.py run --sessions 50 --concurrency 16 --label baseline
+    python mind_benchmark.py compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+    python mind_benchmark.py ab --sessions 20 --rounds 4 [--live] --out ab_transcripts.jsonl
+    python mind_benchmark.py coldstart --repeats 5
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mind_c2d2 import BASE_DIR, C2D2Index
+from mind_classifier import load_or_train
+from mind_engine import SessionEngine, SessionState
+from mind_history import HistoryLog
+from mind_llm import DEFAULT_MODEL, LLM
+from mind_resilience import ResiliencePolicy
+from mind_routing import Router
+from mind_simulate import run_one, sample_starts, scripted_player
+from mind_stub_server import StubConfig, start_server
+from mind_tracing import MetricsAggregator, Tracer
+
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+APP_PATH = os.path.join(BASE_DIR, "mind_cn_web_demo.py")
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def play_timed_round(engine, state, player, timings):
+    """执行一轮并把 generating_sd / waiting_comfort / 场景首字延迟追加到 timings；返回会话是否结束。"""
+    first_token = []
+    started = time.perf_counter()
+    render_scene = lambda value: first_token or first_token.append(time.perf_counter())
+    current_data = engine.generate_scene_and_thought(state, render_scene=render_scene)
+    timings["generating_sd"].append(time.perf_counter() - started)
+    if first_token:
+        timings["ttft_scene"].append(first_token[0] - started)
+
+    comfort = current_data["player_comfort"] = player(state, current_data)
+    started = time.perf_counter()
+    if engine.fused:
+        assessment = engine.assess_convergence(state, current_data)
+        suggestions, memory, progression = engine.run_guide_and_strategist(current_data, comfort, assessment)
+    else:
+        suggestions, memory = engine.run_guide(current_data)
+        progression = engine.run_strategist(memory, comfort, engine.assess_convergence(state, current_data, memory))
+    current_data["guide_suggestions"] = suggestions
+    current_data["memory_summary"] = memory
+    timings["waiting_comfort"].append(time.perf_counter() - started)
+    return engine.record_round(state, current_data, progression)
+
+
+def bench_stages(engine, starts, rounds):
+    """逐轮串行执行，分别计时 generating_sd 与 waiting_comfort 两个阶段。"""
+    timings = {"generating_sd": [], "waiting_comfort": [], "ttft_scene": []}
+    player = scripted_player(random.Random(0))
+    for theme, concern in starts:
+        state = SessionState(theme, concern)
+        for _ in range(rounds):
+            if play_timed_round(engine, state, player, timings):
+                break
+    return {stage: percentiles(samples) for stage, samples in timings.items()}
+
+
+def _fake_round(i):
+    return {
+        "round": i, "theme": "工作问题 (Work issues)", "scene": "周一早上，你刚到公司就被叫进会议室。" * 3,
+        "devil_type": "过度泛化", "devil_thoughts": "我总是把事情搞砸。",
+        "guide_suggestions": ["试着找找证据。", "换个角度想想。"], "memory_summary": "场景：会议室；想法：自责。" * 4,
+        "player_comfort": "别太苛责自己。", "progression_directives": {
+            "next_scene_directive": "延续", "next_thought_directive": "反思", "is_end": "No"},
+    }
+
+
+def bench_rerun(history_sizes, repeats):
+    """用 Streamlit AppTest 测量 waiting_comfort 阶段一次 rerun 的耗时随历史长度的变化。"""
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    for size in history_sizes:
+        at = AppTest.from_file(APP_PATH, default_timeout=60)
+        at.session_state["stage"] = "waiting_comfort"
+        at.session_state["theme"] = "工作问题 (Work issues)"
+        at.session_state["concern"] = "最近工作压力很大"
+        at.session_state["current_round"] = size + 1
+        at.session_state["history"] = HistoryLog(_fake_round(i + 1) for i in range(size))
+        at.session_state["current_data"] = dict(_fake_round(size + 1))
+        at.run() # 预热：导入模块、加载进程级资源
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            at.run()
+            samples.append(time.perf_counter() - started)
+        results[str(size)] = percentiles(samples)
+    return results
+
+
+def bench_throughput(engine, starts, concurrency, max_rounds):
+    player = scripted_player(random.Random(1))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda s: run_one(engine, player, s[0], s[1], max_rounds), starts))
+    wall = time.perf_counter() - started
+    rounds = sum(r["rounds"] for r in results)
+    return {
+        "sessions": len(results),
+        "concurrency": concurrency,
+        "errors": sum(r["ended_by"] == "error" for r in results),
+        "wall_seconds": round(wall, 3),
+        "sessions_per_hour": round(len(results) / wall * 3600, 1),
+        "rounds_per_second": round(rounds / wall, 2),
+        "session_latency": percentiles([r["elapsed_s"] for r in results]),
+    }
+
+
+def run(args):
+    from openai import OpenAI
+
+    config = StubConfig(ttft_ms=args.ttft_ms, chunk_ms=args.chunk_ms, error_rate=args.error_rate,
+                        end_prob=args.end_prob, seed=args.seed, malformed_rate=args.malformed_rate)
+    server, base_url = start_server(config)
+    # AppTest 中的应用通过环境变量连接同一个替身服务
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    client = OpenAI(base_url=base_url, api_key="stub", max_retries=0)
+    index = C2D2Index.load()
+    classifier = load_or_train()
+    # 基准中不使用响应缓存，避免命中掩盖真实的请求延迟
+    tracer = Tracer(MetricsAggregator())
+    # 与线上一致的容错策略 (MIND_MAX_ATTEMPTS / MIND_HEDGE 等环境变量)，便于比较尾延迟
+    resilience = ResiliencePolicy.from_env()
+    router = Router.from_env()
+    engine = SessionEngine(LLM(client, tracer=tracer, resilience=resilience, router=router), index, classifier)
+    streaming_engine = SessionEngine(LLM(client, resilience=resilience, router=router), index, classifier, stream=True)
+    rng = random.Random(args.seed)
+
+    report = {
+        "revision": git_revision(),
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("command", "func")},
+        "stages": bench_stages(streaming_engine, sample_starts(index, args.stage_sessions, rng), args.rounds),
+        "throughput": bench_throughput(engine, sample_starts(index, args.sessions, rng), args.concurrency, args.rounds),
+        # 吞吐量测试中各 Agent 的调用耗时分布
+        "agents": {agent: {"wall_ms": {str(q): round(v, 2) for q, v in stats["wall_ms"].items()}, "calls": stats["calls"]}
+                   for agent, stats in tracer.aggregator.snapshot().items()},
+        "parsing": parse_stats(tracer.aggregator.snapshot()),
+    }
+    if not args.skip_rerun:
+        report["rerun"] = bench_rerun([int(n) for n in args.history_sizes.split(",")], args.rerun_repeats)
+    server.shutdown()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = report["revision"] + (f"-{args.label}" if args.label else "")
+    path = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"结果已保存到 {path}", file=sys.stderr)
+    return 0
+
+
+def parse_stats(agents):
+    """JSON 输出的修复统计。本地修复与补问成功的输出在原先的解析下都会退回占位内容
+    (Strategist 退回默认规划即浪费一轮)；补问只索要缺失字段，比重发整个请求便宜。"""
+    totals = {key: sum(s[key] for s in agents.values()) for key in ("repairs", "field_retries", "parse_fallbacks")}
+    return {
+        "repaired_locally": totals["repairs"],
+        "field_retries": totals["field_retries"],
+        "fallbacks": totals["parse_fallbacks"],
+        "strategist_fallbacks": sum(agents[a]["parse_fallbacks"] for a in ("strategist", "guide-strategist") if a in agents),
+    }
+
+
+def quality_metrics(histories, labels):
+    """不依赖人工评审的输出质量指标：格式约束的满足率、类型是否落在 C2D2 标签集内、结束轮次等。"""
+    rounds = [r for history in histories for r in history]
+    if not rounds:
+        return {}
+    ratio = lambda predicate: round(sum(1 for r in rounds if predicate(r)) / len(rounds), 3)
+    ended = [len(h) for h in histories if h and str(h[-1]["progression_directives"].get("is_end", "")).lower() == "yes"]
+    return {
+        "rounds": len(rounds),
+        "scene_chars_mean": round(statistics.fmean(len(r["scene"]) for r in rounds), 1),
+        "thought_chars_mean": round(statistics.fmean(len(r["devil_thoughts"]) for r in rounds), 1),
+        "scene_within_150": ratio(lambda r: len(r["scene"]) <= 150),
+        "thought_within_30": ratio(lambda r: len(r["devil_thoughts"]) <= 30),
+        "type_in_label_set": ratio(lambda r: r["devil_type"] in labels),
+        "suggestions_1_to_2": ratio(lambda r: 1 <= len(r["guide_suggestions"]) <= 2),
+        "placeholder_output": ratio(lambda r: r["scene"] == "场景生成失败" or r["devil_thoughts"] == "想法生成失败"
+                                    or r["memory_summary"] == "记忆总结失败"),
+        "sessions_ended": len(ended),
+        "mean_rounds_to_end": round(statistics.fmean(ended), 2) if ended else None,
+    }
+
+
+def run_ab_mode(client, index, classifier, fused, starts, args):
+    tracer = Tracer(MetricsAggregator())
+    llm = LLM(client, model=args.model or DEFAULT_MODEL, tracer=tracer, resilience=ResiliencePolicy.from_env(),
+              router=None if args.model else Router.from_env())
+    engine = SessionEngine(llm, index, classifier, stream=True, fused=fused)
+    player = scripted_player(random.Random(args.seed))
+    timings = {"generating_sd": [], "waiting_comfort": [], "ttft_scene": []}
+    lock = threading.Lock()
+
+    def one(start):
+        state = SessionState(*start)
+        local = {key: [] for key in timings}
+        for _ in range(args.rounds):
+            if play_timed_round(engine, state, player, local):
+                break
+        with lock:
+            for key, samples in local.items():
+                timings[key].extend(samples)
+        return state.history.to_list()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        histories = list(pool.map(one, starts))
+    wall = time.perf_counter() - started
+    agents = tracer.aggregator.snapshot()
+    round_count = sum(len(h) for h in histories) or 1
+    return {
+        "wall_seconds": round(wall, 3),
+        "stages": {stage: percentiles(samples) for stage, samples in timings.items()},
+        # 一轮中等待模型的总时间 (不含用户输入)
+        "round_ms_mean": round((statistics.fmean(timings["generating_sd"]) + statistics.fmean(timings["waiting_comfort"])) * 1000, 2),
+        "calls_per_round": round(sum(s["calls"] for s in agents.values()) / round_count, 2),
+        "tokens_per_round": round(sum(s["prompt_tokens"] + s["completion_tokens"] for s in agents.values()) / round_count, 1),
+        "cost_usd_per_round": round(sum(s["cost_usd"] for s in agents.values()) / round_count, 6),
+        "parse_fallbacks": sum(s["parse_fallbacks"] for s in agents.values()),
+        "parsing": parse_stats(agents),
+        "errors": sum(s["errors"] for s in agents.values()),
+        "quality": quality_metrics(histories, set(classifier.labels) if classifier is not None else set()),
+    }, histories
+
+
+def ab(args):
+    from openai import OpenAI
+
+    server = None
+    if args.live:
+        client = OpenAI()
+    else:
+        server, base_url = start_server(StubConfig(ttft_ms=args.ttft_ms, chunk_ms=args.chunk_ms,
+                                                   end_prob=args.end_prob, seed=args.seed,
+                                                   malformed_rate=args.malformed_rate))
+        client = OpenAI(base_url=base_url, api_key="stub", max_retries=0)
+    index = C2D2Index.load()
+    classifier = load_or_train()
+    starts = sample_starts(index, args.sessions, random.Random(args.seed))
+
+    report = {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "live": args.live,
+              "config": {k: v for k, v in vars(args).items() if k not in ("command", "func")}}
+    transcripts = []
+    for mode in ("split", "fused"):
+        report[mode], histories = run_ab_mode(client, index, classifier, mode == "fused", starts, args)
+        transcripts.extend({"mode": mode, "theme": s[0], "concern": s[1], "history": h} for s, h in zip(starts, histories))
+    if server is not None:
+        server.shutdown()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for record in transcripts:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    split, fused = _flatten(report["split"]), _flatten(report["fused"])
+    for key in sorted(split.keys() & fused.keys()):
+        if split[key] and not key.endswith(".n"):
+            print(f"{key:40s} split {split[key]:>10}  fused {fused[key]:>10}  ({(fused[key] - split[key]) / split[key] * 100:+.1f}%)",
+                  file=sys.stderr)
+    return 0
+
+
+def _flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        if key in ("config", "revision", "label", "timestamp", "python"):
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(args):
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    old, new = _flatten(before), _flatten(after)
+    print(f"{before['revision']} -> {after['revision']}")
+    for key in sorted(old.keys() & new.keys()):
+        if old[key] == new[key] or key.endswith(".n"):
+            continue
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else float("inf")
+        print(f"{key:45s} {old[key]:>12} -> {new[key]:>12}  ({change:+.1f}%)")
+    return 0
+
+
+def import_profile(module, env):
+    """在新进程中用 -X importtime 导入 module；返回 (总耗时 ms, {顶层包: 自身耗时之和 ms})。"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True)
+    total, by_package = 0.0, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        package = name.split(".")[0]
+        by_package[package] = by_package.get(package, 0.0) + int(self_us) / 1000
+        if name == module:
+            total = int(cumulative_us) / 1000
+    return total, by_package
+
+
+_FIRST_PAINT = """
+import time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({path!r}, default_timeout=60)
+started = time.perf_counter()
+at.run()
+print(time.perf_counter() - started)
+"""
+
+
+def coldstart(args):
+    """冷启动：模块导入耗时与 start 阶段首屏渲染耗时，每次都在新进程中测量。"""
+    env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "stub"), "MIND_TRACE": "memory",
+           "MIND_SESSION_STORE": "memory"}
+    imports, packages = [], {}
+    for _ in range(args.repeats):
+        total, by_package = import_profile("mind_cn_web_demo", env)
+        imports.append(total / 1000)
+        for package, ms in by_package.items():
+            packages.setdefault(package, []).append(ms)
+    first_paint = [
+        float(subprocess.run([sys.executable, "-c", _FIRST_PAINT.format(path=APP_PATH)], cwd=BASE_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1])
+        for _ in range(args.repeats)
+    ]
+    heaviest = sorted(((package, statistics.median(ms)) for package, ms in packages.items()), key=lambda item: -item[1])
+    report = {
+        "revision": git_revision(),
+        "import": percentiles(imports),
+        "first_paint": percentiles(first_paint),
+        "heaviest_packages_ms": {package: round(ms, 1) for package, ms in heaviest[:args.top]},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MIND 端到端延迟基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run")
+    run_parser.add_argument("--sessions", type=int, default=50, help="吞吐量测试的会话数")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--stage-sessions", type=int, default=5, help="阶段延迟测试的会话数 (串行)")
+    run_parser.add_argument("--rounds", type=int, default=3, help="每场会话的最大轮数")
+    run_parser.add_argument("--history-sizes", default="0,10,40")
+    run_parser.add_argument("--rerun-repeats", type=int, default=5)
+    run_parser.add_argument("--skip-rerun", action="store_true")
+    run_parser.add_argument("--ttft-ms", type=float, default=200.0)
+    run_parser.add_argument("--chunk-ms", type=float, default=10.0)
+    run_parser.add_argument("--error-rate", type=float, default=0.0)
+    run_parser.add_argument("--end-prob", type=float, default=0.15)
+    run_parser.add_argument("--malformed-rate", type=float, default=0.0, help="替身服务 JSON 输出带格式缺陷的比例")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--label", default="")
+    run_parser.set_defaults(func=run)
+    compare_parser = sub.add_parser("compare")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+    ab_parser = sub.add_parser("ab", help="对比四次调用 (split) 与合并调用 (fused) 两种模式")
+    ab_parser.add_argument("--sessions", type=int, default=20)
+    ab_parser.add_argument("--rounds", type=int, default=4)
+    ab_parser.add_argument("--concurrency", type=int, default=4)
+    ab_parser.add_argument("--live", action="store_true", help="使用真实 API (OPENAI_API_KEY / OPENAI_BASE_URL)，默认用替身服务")
+    ab_parser.add_argument("--model", default=os.getenv("MIND_MODEL"), help="所有 Agent 统一使用的模型；不设置时按路由表")
+    ab_parser.add_argument("--ttft-ms", type=float, default=400.0)
+    ab_parser.add_argument("--chunk-ms", type=float, default=15.0)
+    ab_parser.add_argument("--end-prob", type=float, default=0.15)
+    ab_parser.add_argument("--malformed-rate", type=float, default=0.0, help="替身服务 JSON 输出带格式缺陷的比例")
+    ab_parser.add_argument("--seed", type=int, default=0)
+    ab_parser.add_argument("--out", default="", help="把两种模式的完整对话写入 JSONL，便于人工或 LLM 评审")
+    ab_parser.set_defaults(func=ab)
+    coldstart_parser = sub.add_parser("coldstart", help="界面模块的导入耗时与首屏渲染耗时")
+    coldstart_parser.add_argument("--repeats", type=int, default=5)
+    coldstart_parser.add_argument("--top", type=int, default=10, help="列出自身导入耗时最多的前 N 个顶层包")
+    coldstart_parser.set_defaults(func=coldstart)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+"""C2D2 数据集的一次性导入 (GBK CSV -> UTF-8 列式缓存) 与字符 n-gram BM25 场景检索。
+
+用法:
+    python mind_c2d2.py ingest            # 生成 .cache/c2d2/
+    python mind_c2d2.py query "工作压力很大，总觉得自己做不好"
+"""
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_PATH = os.path.join(BASE_DIR, "C2D2_dataset.csv")
+CACHE_DIR = os.path.join(BASE_DIR, ".cache", "c2d2")
+CACHE_VERSION = 1
+
+TEXT_COLUMNS = ("scene", "thought")
+NGRAM_SIZES = (1, 2)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 这些字符不参与 n-gram (标点、空白)
+_SKIP_CHARS = set(" \t\r\n，。！？、；：“”‘’（）《》…—,.!?;:\"'()[]")
+
+
+def char_ngrams(text, sizes=NGRAM_SIZES):
+    chars = [c for c in text if c not in _SKIP_CHARS]
+    grams = []
+    for n in sizes:
+        grams.extend("".join(chars[i:i + n]) for i in range(len(chars) - n + 1))
+    return grams
+
+
+def read_dataset(path=DATASET_PATH):
+    """读取原始 GBK 编码的 C2D2 CSV，返回 (num, scene, thought, label) 列表。"""
+    with open(path, encoding="gbk", newline="") as f:
+        reader = csv.reader(f)
+        next(reader) # 表头: Num,场景,思维,标签
+        return [(int(num), scene.strip(), thought.strip(), label.strip()) for num, scene, thought, label in reader]
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime), "version": CACHE_VERSION}
+
+
+def _write_text_column(out_dir, name, values):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    np.save(os.path.join(out_dir, f"{name}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(out_dir, f"{name}_offsets.npy"), offsets)
+
+
+def _build_bm25(docs):
+    """构建按词项排序的倒排表，每个 posting 预先算好 BM25 权重，查询时只需累加。"""
+    vocab = {}
+    doc_ids = []
+    term_ids = []
+    for doc_id, text in enumerate(docs):
+        for gram in char_ngrams(text):
+            term_ids.append(vocab.setdefault(gram, len(vocab)))
+            doc_ids.append(doc_id)
+    n_docs, n_terms = len(docs), len(vocab)
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    term_ids = np.asarray(term_ids, dtype=np.int64)
+
+    # (term, doc) 对去重得到词频，顺带完成按 term 排序
+    pairs, tf = np.unique(term_ids * n_docs + doc_ids, return_counts=True)
+    post_terms, post_docs = np.divmod(pairs, n_docs)
+
+    doc_len = np.bincount(doc_ids, minlength=n_docs).astype(np.float32)
+    avg_len = float(doc_len.mean()) if n_docs else 0.0
+    df = np.bincount(post_terms, minlength=n_terms).astype(np.float32)
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[post_docs] / max(avg_len, 1e-6))
+    weights = idf[post_terms] * tf * (BM25_K1 + 1) / (tf + norm)
+
+    indptr = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(df.astype(np.int64), out=indptr[1:])
+    return vocab, indptr, post_docs.astype(np.int32), weights.astype(np.float32)
+
+
+def ingest(csv_path=DATASET_PATH, out_dir=CACHE_DIR):
+    """解码 GBK 数据集并写出可内存映射的列式缓存与 BM25 索引。"""
+    rows = read_dataset(csv_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    labels = sorted({row[3] for row in rows})
+    label_index = {label: i for i, label in enumerate(labels)}
+    np.save(os.path.join(out_dir, "num.npy"), np.asarray([row[0] for row in rows], dtype=np.int32))
+    np.save(os.path.join(out_dir, "label.npy"), np.asarray([label_index[row[3]] for row in rows], dtype=np.uint8))
+    _write_text_column(out_dir, "scene", [row[1] for row in rows])
+    _write_text_column(out_dir, "thought", [row[2] for row in rows])
+
+    vocab, indptr, post_docs, weights = _build_bm25([f"{row[1]}\n{row[2]}" for row in rows])
+    np.save(os.path.join(out_dir, "bm25_indptr.npy"), indptr)
+    np.save(os.path.join(out_dir, "bm25_docs.npy"), post_docs)
+    np.save(os.path.join(out_dir, "bm25_weights.npy"), weights)
+    with open(os.path.join(out_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+    # manifest 最后写入，作为缓存完整的标志
+    manifest = {"rows": len(rows), "labels": labels, "source": _source_signature(csv_path)}
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return manifest
+
+
+def _cache_is_fresh(csv_path, out_dir):
+    try:
+        with open(os.path.join(out_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return manifest.get("source") == _source_signature(csv_path)
+
+
+class TextColumn:
+    """内存映射的 UTF-8 文本列，按行惰性解码。"""
+
+    def __init__(self, out_dir, name):
+        self._blob = np.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode="r")
+        self._offsets = np.load(os.path.join(out_dir, f"{name}_offsets.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+
+class C2D2Index:
+    def __init__(self, out_dir=CACHE_DIR):
+        with open(os.path.join(out_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(os.path.join(out_dir, "vocab.json"), encoding="utf-8") as f:
+            self._vocab = json.load(f)
+        self.labels = manifest["labels"]
+        self.num = np.load(os.path.join(out_dir, "num.npy"), mmap_mode="r")
+        self.label = np.load(os.path.join(out_dir, "label.npy"), mmap_mode="r")
+        self.scene = TextColumn(out_dir, "scene")
+        self.thought = TextColumn(out_dir, "thought")
+        self._indptr = np.load(os.path.join(out_dir, "bm25_indptr.npy"), mmap_mode="r")
+        self._docs = np.load(os.path.join(out_dir, "bm25_docs.npy"), mmap_mode="r")
+        self._weights = np.load(os.path.join(out_dir, "bm25_weights.npy"), mmap_mode="r")
+        self._n_docs = manifest["rows"]
+
+    @classmethod
+    def load(cls, csv_path=DATASET_PATH, out_dir=CACHE_DIR):
+        """加载缓存；缓存缺失或源文件已变化时先重新导入。"""
+        if not _cache_is_fresh(csv_path, out_dir):
+            ingest(csv_path, out_dir)
+        return cls(out_dir)
+
+    def __len__(self):
+        return self._n_docs
+
+    def label_mask(self, exclude_labels):
+        codes = [self.labels.index(label) for label in exclude_labels if label in self.labels]
+        return np.isin(self.label, codes)
+
+    def scores(self, query):
+        term_ids = {self._vocab[g] for g in char_ngrams(query) if g in self._vocab}
+        if not term_ids:
+            return np.zeros(self._n_docs, dtype=np.float32)
+        slices = [slice(self._indptr[t], self._indptr[t + 1]) for t in term_ids]
+        docs = np.concatenate([self._docs[s] for s in slices])
+        weights = np.concatenate([self._weights[s] for s in slices])
+        return np.bincount(docs, weights=weights, minlength=self._n_docs)
+
+    def search(self, query, k=3, exclude_labels=()):
+        """返回 BM25 得分最高的 k 条记录 (dict)，可排除指定标签 (例如 "非扭曲")。"""
+        scores = self.scores(query)
+        if exclude_labels:
+            scores[self.label_mask(exclude_labels)] = -np.inf
+        k = min(k, self._n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.record(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def record(self, i, score=None):
+        return {
+            "num": int(self.num[i]),
+            "scene": self.scene[i],
+            "thought": self.thought[i],
+            "label": self.labels[self.label[i]],
+            "score": score,
+        }
+
+
+def format_examples(records, with_thought=True):
+    """把检索结果整理成可直接填入提示词的案例列表。"""
+    if not records:
+        return "无"
+    lines = []
+    for r in records:
+        line = f"- 场景：{r['scene']}"
+        if with_thought:
+            line += f" 想法：{r['thought']} (类型：{r['label'] or '未标注'})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv):
+    if len(argv) >= 1 and argv[0] == "ingest":
+        start = time.perf_counter()
+        manifest = ingest()
+        print(f"已导入 {manifest['rows']} 条记录到 {CACHE_DIR} ({time.perf_counter() - start:.2f}s)")
+    elif len(argv) >= 2 and argv[0] == "query":
+        index = C2D2Index.load()
+        index.search(argv[1]) # 预热
+        start = time.perf_counter()
+        rounds = 200
+        for _ in range(rounds):
+            results = index.search(argv[1], k=5)
+        elapsed = (time.perf_counter() - start) / rounds
+        for r in results:
+            print(f"[{r['score']:.2f}] #{r['num']} {r['scene']} | {r['thought']} ({r['label']})")
+        print(f"平均每次查询 {elapsed * 1000:.3f} ms")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,212 @@
+"""call_gpt 的两级响应缓存：进程内 LRU + 磁盘 SQLite (带 TTL 与容量淘汰)。"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(BASE_DIR, ".cache", "mind_responses.sqlite3")
+
+# 各 Agent 的缓存策略：
+#   always        - 总是缓存 (同一主题+担忧渲染出的 trigger_0 提示词完全相同)
+#   deterministic - 仅在 temperature == 0 (确定性模式) 时缓存
+#   never         - 从不缓存 (Devil/Strategist 需要保留随机性和对话推进)
+DEFAULT_POLICY = {
+    "trigger": "always",
+    "devil": "never",
+    "guide": "deterministic",
+    "strategist": "never",
+    # 合并调用模式中包含 Devil / Strategist 的输出，同样不缓存
+    "scene-thought": "never",
+    "guide-strategist": "never",
+}
+
+
+def make_key(template_id, filled_prompt, system_role, model, temperature, response_format, max_tokens=None):
+    # max_tokens 也在键中：调整路由的输出上限后不再返回按旧上限生成 (可能被截断) 的响应
+    payload = json.dumps(
+        [template_id, filled_prompt, system_role, model, temperature, response_format, max_tokens],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=20000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self.ttl and now - created > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            # 超出容量时按最近访问时间淘汰最旧的条目
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """先查内存 LRU，再查 SQLite；磁盘命中会回填到内存。"""
+
+    def __init__(self, memory=None, disk=None, policy=None):
+        self.memory = memory
+        self.disk = disk
+        self.policy = dict(DEFAULT_POLICY, **(policy or {}))
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @classmethod
+    def from_env(cls):
+        # MIND_CACHE: off / memory (默认) / disk；MIND_CACHE_PATH 默认为本模块所在目录下的 .cache/mind_responses.sqlite3
+        mode = os.getenv("MIND_CACHE", "memory").lower()
+        if mode == "off":
+            return cls(policy={agent: "never" for agent in DEFAULT_POLICY})
+        memory = LRUCache(int(os.getenv("MIND_CACHE_MAXSIZE", "512")))
+        disk = None
+        if mode == "disk":
+            disk = SQLiteCache(
+                os.getenv("MIND_CACHE_PATH", DEFAULT_CACHE_PATH),
+                ttl=float(os.getenv("MIND_CACHE_TTL", str(7 * 24 * 3600))),
+                max_entries=int(os.getenv("MIND_CACHE_MAX_ENTRIES", "20000")),
+            )
+        return cls(memory, disk, parse_policy(os.getenv("MIND_CACHE_POLICY", "")))
+
+    def enabled_for(self, agent, temperature):
+        mode = self.policy.get(agent, "never")
+        if mode == "always":
+            return True
+        if mode == "deterministic":
+            return temperature == 0
+        return False
+
+    def get(self, agent, key):
+        value = self.memory.get(key) if self.memory is not None else None
+        tier = "memory"
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            tier = "disk"
+            if value is not None and self.memory is not None:
+                self.memory.set(key, value)
+        self._count(agent, f"{tier}_hits" if value is not None else "misses")
+        return value
+
+    def set(self, key, value):
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def _count(self, agent, field):
+        with self._lock:
+            counters = self._stats.setdefault(agent, {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+            counters[field] += 1
+
+    def stats(self):
+        """按 Agent 返回命中/未命中计数，以及汇总。"""
+        with self._lock:
+            per_agent = {agent: dict(counters) for agent, counters in self._stats.items()}
+        total = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        for counters in per_agent.values():
+            for field, value in counters.items():
+                total[field] += value
+        lookups = sum(total.values())
+        total["hit_rate"] = (total["memory_hits"] + total["disk_hits"]) / lookups if lookups else 0.0
+        return {"agents": per_agent, "total": total}
+
+
+def parse_policy(spec):
+    """解析 "trigger=always,devil=never" 形式的策略覆盖。"""
+    policy = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        agent, mode = (part.strip() for part in item.split("=", 1))
+        if mode not in ("always", "deterministic", "never"):
+            raise ValueError(f"未知的缓存策略: {item}")
+        policy[agent] = mode
+    return policy
@@ -0,0 +1,249 @@
+"""基于 C2D2 `思维 -> 标签` 训练的本地认知扭曲分类器 (字符 n-gram 多项式朴素贝叶斯，仅用 CPU)。
+
+用法:
+    python mind_classifier.py train                 # 训练并保存到 .cache/distortion_nb.npz
+    python mind_classifier.py bench [--llm N]       # 留出集准确率与吞吐量，可选对比 LLM 路径
+    python mind_classifier.py predict "我总是把事情搞砸"
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from mind_c2d2 import BASE_DIR, DATASET_PATH, char_ngrams, read_dataset
+
+MODEL_PATH = os.path.join(BASE_DIR, ".cache", "distortion_nb.npz")
+NGRAM_SIZES = (1, 2, 3)
+DEFAULT_ALPHA = 0.3
+
+# LLM 常见的自由文本类型 -> C2D2 标签
+TYPE_ALIASES = {
+    "读心术": ("读心", "揣测他人", "mind reading"),
+    "过度泛化": ("过度概括", "以偏概全", "泛化", "overgeneraliz"),
+    "情绪化推理": ("情绪推理", "情感推理", "emotional reasoning"),
+    "乱贴标签": ("贴标签", "标签化", "labeling", "labelling"),
+    "个人化归责": ("个人化", "自我归咎", "归咎于自己", "personaliz"),
+    "非黑即白": ("全或无", "黑白思维", "二元思维", "两极化", "all-or-nothing", "black-and-white"),
+    "算命": ("预言", "预测未来", "灾难化", "灾难性思维", "fortune telling", "catastroph"),
+    "非扭曲": ("无扭曲", "没有扭曲", "non-distorted", "no distortion"),
+}
+
+
+def normalize_type(text):
+    """把 LLM 给出的类型文本映射到 C2D2 标签集合，无法识别时返回 None。"""
+    if not text:
+        return None
+    lowered = text.strip().lower()
+    for label, aliases in TYPE_ALIASES.items():
+        if label in text or any(alias.lower() in lowered for alias in aliases):
+            return label
+    return None
+
+
+class DistortionClassifier:
+    def __init__(self, labels, vocab, class_log_prior, feature_log_prob):
+        self.labels = list(labels)
+        self._vocab = vocab
+        self._class_log_prior = class_log_prior
+        self._feature_log_prob = feature_log_prob # (n_terms, n_classes)
+
+    @classmethod
+    def train(cls, texts, labels, alpha=DEFAULT_ALPHA):
+        label_set = sorted(set(labels))
+        label_index = {label: i for i, label in enumerate(label_set)}
+        vocab = {}
+        term_ids = []
+        class_ids = []
+        for text, label in zip(texts, labels):
+            for gram in char_ngrams(text, NGRAM_SIZES):
+                term_ids.append(vocab.setdefault(gram, len(vocab)))
+                class_ids.append(label_index[label])
+        n_terms, n_classes = len(vocab), len(label_set)
+        counts = np.zeros((n_terms, n_classes), dtype=np.float64)
+        np.add.at(counts, (np.asarray(term_ids), np.asarray(class_ids)), 1)
+        counts += alpha
+        feature_log_prob = np.log(counts / counts.sum(axis=0, keepdims=True)).astype(np.float32)
+        class_counts = np.bincount([label_index[label] for label in labels], minlength=n_classes)
+        class_log_prior = np.log(class_counts / class_counts.sum()).astype(np.float32)
+        return cls(label_set, vocab, class_log_prior, feature_log_prob)
+
+    def save(self, path=MODEL_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        terms = sorted(self._vocab, key=self._vocab.get)
+        np.savez_compressed(
+            path,
+            labels=np.asarray(self.labels),
+            terms=np.asarray(terms),
+            class_log_prior=self._class_log_prior,
+            feature_log_prob=self._feature_log_prob,
+        )
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path) as data:
+            terms = data["terms"].tolist()
+            return cls(
+                data["labels"].tolist(),
+                {term: i for i, term in enumerate(terms)},
+                data["class_log_prior"],
+                data["feature_log_prob"],
+            )
+
+    def decision_scores(self, texts):
+        """批量计算每条文本在各标签上的对数后验 (未归一化)，形状 (len(texts), n_classes)。"""
+        doc_ids = []
+        term_ids = []
+        for doc_id, text in enumerate(texts):
+            for gram in char_ngrams(text, NGRAM_SIZES):
+                term_id = self._vocab.get(gram)
+                if term_id is not None:
+                    term_ids.append(term_id)
+                    doc_ids.append(doc_id)
+        scores = np.tile(self._class_log_prior, (len(texts), 1))
+        if term_ids:
+            contributions = self._feature_log_prob[np.asarray(term_ids)]
+            np.add.at(scores, np.asarray(doc_ids), contributions)
+        return scores
+
+    def predict(self, texts):
+        """批量预测，返回 C2D2 标签列表。"""
+        if not texts:
+            return []
+        return [self.labels[i] for i in self.decision_scores(texts).argmax(axis=1)]
+
+    def predict_one(self, text):
+        return self.predict([text])[0]
+
+
+def load_or_train(path=MODEL_PATH, csv_path=DATASET_PATH):
+    """加载已保存的模型；模型文件缺失或早于数据集时在全部数据上重新训练并保存。"""
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path):
+        return DistortionClassifier.load(path)
+    texts, labels = _labelled_thoughts(csv_path)
+    model = DistortionClassifier.train(texts, labels)
+    model.save(path)
+    return model
+
+
+def _labelled_thoughts(csv_path=DATASET_PATH):
+    rows = [row for row in read_dataset(csv_path) if row[3]]
+    return [row[2] for row in rows], [row[3] for row in rows]
+
+
+def split_holdout(texts, labels, test_ratio=0.2, seed=0):
+    """按标签分层划分训练集 / 留出集；留出集顺序已打乱，其任意前缀的标签分布近似于整体。"""
+    rng = random.Random(seed)
+    by_label = {}
+    for i, label in enumerate(labels):
+        by_label.setdefault(label, []).append(i)
+    train_idx, test_idx = [], []
+    for indices in by_label.values():
+        rng.shuffle(indices)
+        cut = max(1, int(len(indices) * test_ratio))
+        test_idx.extend(indices[:cut])
+        train_idx.extend(indices[cut:])
+    # 打乱留出集顺序，使 bench --llm N 取前 N 条时覆盖各个标签，而不是只取到第一个标签
+    rng.shuffle(test_idx)
+    pick = lambda idx, seq: [seq[i] for i in idx]
+    return pick(train_idx, texts), pick(train_idx, labels), pick(test_idx, texts), pick(test_idx, labels)
+
+
+def evaluate(model, texts, labels):
+    predictions = model.predict(texts)
+    accuracy = sum(p == y for p, y in zip(predictions, labels)) / len(labels)
+    per_label = {}
+    for label in model.labels:
+        tp = sum(p == y == label for p, y in zip(predictions, labels))
+        predicted = sum(p == label for p in predictions)
+        actual = sum(y == label for y in labels)
+        precision = tp / predicted if predicted else 0.0
+        recall = tp / actual if actual else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_label[label] = {"precision": precision, "recall": recall, "f1": f1, "support": actual}
+    macro_f1 = sum(m["f1"] for m in per_label.values()) / len(per_label)
+    return {"accuracy": accuracy, "macro_f1": macro_f1, "per_label": per_label}
+
+
+def benchmark_throughput(model, texts, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model.predict(texts)
+    batch_seconds = (time.perf_counter() - start) / repeat
+    sample = texts[:200]
+    start = time.perf_counter()
+    for text in sample:
+        model.predict_one(text)
+    single_seconds = (time.perf_counter() - start) / len(sample)
+    return {"batch_per_second": len(texts) / batch_seconds, "single_latency_us": single_seconds * 1e6}
+
+
+def benchmark_llm(texts, labels, n, model_name="gpt-4o"):
+    """用与 devil_0 相同的 `Type:` 问法让 LLM 标注 n 条留出样本，用于和本地分类器对比。"""
+    from openai import OpenAI
+
+    client = OpenAI()
+    label_list = "、".join(sorted(set(labels)))
+    correct, latencies = 0, []
+    for text, label in list(zip(texts, labels))[:n]:
+        start = time.perf_counter()
+        completion = client.chat.completions.create(
+            model=model_name,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": "你是认知行为疗法专家"},
+                {"role": "user", "content": f"判断以下想法的认知扭曲类型，可选：{label_list}。\n想法：{text}\n输出格式：\nType: <认知扭曲类型>"},
+            ],
+        )
+        latencies.append(time.perf_counter() - start)
+        answer = completion.choices[0].message.content or ""
+        correct += normalize_type(answer.split("Type:")[-1]) == label
+    return {"accuracy": correct / n, "mean_latency_ms": 1000 * sum(latencies) / n}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="C2D2 认知扭曲分类器")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("train")
+    bench = sub.add_parser("bench")
+    bench.add_argument("--alpha", type=float, default=DEFAULT_ALPHA)
+    bench.add_argument("--llm", type=int, default=0, help="同时用 LLM 标注的留出样本数 (需要 OPENAI_API_KEY)")
+    predict = sub.add_parser("predict")
+    predict.add_argument("texts", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        texts, labels = _labelled_thoughts()
+        model = DistortionClassifier.train(texts, labels)
+        model.save()
+        print(f"已在 {len(texts)} 条样本上训练，模型保存到 {MODEL_PATH}")
+    elif args.command == "bench":
+        train_x, train_y, test_x, test_y = split_holdout(*_labelled_thoughts())
+        start = time.perf_counter()
+        model = DistortionClassifier.train(train_x, train_y, alpha=args.alpha)
+        train_seconds = time.perf_counter() - start
+        report = evaluate(model, test_x, test_y)
+        speed = benchmark_throughput(model, test_x)
+        print(f"训练样本 {len(train_x)}，留出样本 {len(test_x)}，训练耗时 {train_seconds:.2f}s")
+        print(f"准确率 {report['accuracy']:.3f}，macro-F1 {report['macro_f1']:.3f}")
+        for label, m in report["per_label"].items():
+            print(f"  {label}: P={m['precision']:.2f} R={m['recall']:.2f} F1={m['f1']:.2f} (n={m['support']})")
+        print(f"批量吞吐 {speed['batch_per_second']:.0f} 条/秒，单条延迟 {speed['single_latency_us']:.0f} µs")
+        if args.llm:
+            llm = benchmark_llm(test_x, test_y, args.llm)
+            local = evaluate(model, test_x[:args.llm], test_y[:args.llm])
+            print(f"LLM ({args.llm} 条): 准确率 {llm['accuracy']:.3f}，平均延迟 {llm['mean_latency_ms']:.0f} ms；"
+                  f"同样本本地准确率 {local['accuracy']:.3f}")
+    else:
+        model = load_or_train()
+        for text, label in zip(args.texts, model.predict(args.texts)):
+            print(f"{label}\t{text}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
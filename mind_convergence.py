@@ -0,0 +1,209 @@
+"""会话收敛检测：用连续几轮 Devil 想法 (Dᵢ) 与记忆总结 (Mᵢ) 的字符 n-gram 相似度，以及认知扭曲类型的变化轨迹，
+判断对话是否陷入循环 (stagnant) 或已经收敛 (converged)。纯本地计算，不调用 LLM。
+
+检测结果可以作为建议写入 Strategist 的输入 (advise)，也可以直接结束会话 (end)：拆分模式下跳过本轮的
+Strategist 调用，两种模式都省去之后各轮的全部调用。
+
+环境变量:
+    MIND_CONVERGENCE=off|advise|end (默认 advise)
+    MIND_CONVERGENCE_THRESHOLDS="thought=0.6,memory=0.7,window=2,min_rounds=3"
+
+离线评估 (基于 mind_simulate.py 输出的 JSONL)：
+    python mind_convergence.py eval sessions.jsonl [--calls-per-round 4] [--sweep]
+"""
+import argparse
+import json
+import os
+import sys
+
+MODES = ("off", "advise", "end")
+DEFAULT_THRESHOLDS = {"thought": 0.6, "memory": 0.7, "window": 2, "min_rounds": 3}
+NGRAM = 2
+_SKIP_CHARS = set(" \t\r\n，。！？、；：“”‘’（）《》…—,.!?;:\"'()[]")
+
+PROGRESSING = "progressing"
+STAGNANT = "stagnant"
+CONVERGED = "converged"
+
+
+def char_ngrams(text, n=NGRAM):
+    chars = [c for c in text or "" if c not in _SKIP_CHARS]
+    if len(chars) < n:
+        return {"".join(chars)} if chars else set()
+    return {"".join(chars[i:i + n]) for i in range(len(chars) - n + 1)}
+
+
+def similarity(a, b, n=NGRAM):
+    """两段文本字符 n-gram 集合的 Dice 系数 (0~1)。"""
+    grams_a, grams_b = char_ngrams(a, n), char_ngrams(b, n)
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def parse_thresholds(spec):
+    """解析 "thought=0.6,memory=0.7,window=2" 形式的阈值覆盖。"""
+    thresholds = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        key, value = (part.strip() for part in item.split("=", 1))
+        thresholds[key] = int(value) if key in ("window", "min_rounds") else float(value)
+    return thresholds
+
+
+class Assessment:
+    __slots__ = ("status", "thought_similarity", "memory_similarity", "type_streak", "devil_type")
+
+    def __init__(self, status, thought_similarity=None, memory_similarity=None, type_streak=0, devil_type=None):
+        self.status = status
+        self.thought_similarity = thought_similarity # 最近 window 对相邻 Dᵢ 相似度的最小值
+        self.memory_similarity = memory_similarity
+        self.type_streak = type_streak # 末尾连续相同的认知扭曲类型轮数
+        self.devil_type = devil_type
+
+    @property
+    def flagged(self):
+        return self.status != PROGRESSING
+
+    def note(self):
+        """写入 Strategist 输入的建议文本。"""
+        if self.status == STAGNANT:
+            return (f"最近 {self.type_streak} 轮患者的想法几乎没有变化 (相似度 {self.thought_similarity:.2f})，"
+                    f"认知扭曲类型一直是「{self.devil_type}」，对话陷入循环。请让下一轮场景明显推进或换一个角度；"
+                    f"若用户的安慰已经稳定，可以判断 is_end 为 Yes。")
+        if self.status == CONVERGED:
+            return (f"最近几轮的记忆总结几乎没有新信息 (相似度 {self.memory_similarity:.2f})，对话已趋于收敛，"
+                    f"请认真考虑结束对话 (is_end 为 Yes)。")
+        return "无"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ConvergenceDetector:
+    """stagnant: 最近 window 对相邻 Dᵢ 的相似度都不低于 thought 阈值，且这些轮次的类型相同；
+    converged: 最近 window 对相邻 Mᵢ 的相似度都不低于 memory 阈值。会话不足 min_rounds 轮时不做判断。"""
+
+    def __init__(self, mode="advise", thought=0.6, memory=0.7, window=2, min_rounds=3):
+        self.mode = mode
+        self.thought = thought
+        self.memory = memory
+        self.window = window
+        self.min_rounds = min_rounds
+
+    @classmethod
+    def from_env(cls):
+        mode = os.getenv("MIND_CONVERGENCE", "advise").lower()
+        if mode == "off":
+            return None
+        if mode not in MODES:
+            raise ValueError(f"MIND_CONVERGENCE 应为 {'/'.join(MODES)}，而不是 {mode!r}")
+        return cls(mode, **{**DEFAULT_THRESHOLDS, **parse_thresholds(os.getenv("MIND_CONVERGENCE_THRESHOLDS", ""))})
+
+    def assess(self, history, current_data, memory_summary=None):
+        """history 为之前各轮，current_data 为本轮 (已有 Dᵢ 与类型)；memory_summary 为本轮的 Mᵢ，
+        合并调用模式下调用 Strategist 前还没有本轮的 Mᵢ，只用之前各轮的。"""
+        previous = history[-self.window:] if self.window else []
+        if len(history) + 1 < self.min_rounds or len(previous) < self.window:
+            return Assessment(PROGRESSING)
+        rounds = list(previous) + [current_data]
+
+        thoughts = [r.get("devil_thoughts") or "" for r in rounds]
+        thought_sim = min(similarity(a, b) for a, b in zip(thoughts, thoughts[1:]))
+        types = [r.get("devil_type") for r in rounds]
+        streak = 1
+        while streak < len(types) and types[-streak - 1] == types[-1]:
+            streak += 1
+
+        memories = [r.get("memory_summary") or "" for r in previous]
+        if memory_summary is not None:
+            memories.append(memory_summary)
+        memory_sim = min((similarity(a, b) for a, b in zip(memories, memories[1:])), default=None)
+
+        status = PROGRESSING
+        if thought_sim >= self.thought and streak == len(types) and types[-1] not in (None, "未知"):
+            status = STAGNANT
+        elif memory_sim is not None and memory_sim >= self.memory:
+            status = CONVERGED
+        return Assessment(status, thought_sim, memory_sim, streak, types[-1])
+
+    def should_end(self, assessment):
+        return self.mode == "end" and assessment is not None and assessment.flagged
+
+
+def convergence_progression(assessment):
+    """end 模式下代替 Strategist 输出的结束规划。"""
+    return {
+        "next_scene_directive": "对话已收敛，结束",
+        "next_thought_directive": "对话已收敛，结束",
+        "is_end": "Yes",
+        "convergence": assessment.status,
+    }
+
+
+# --- 离线评估 ---
+def load_histories(path):
+    with open(path, encoding="utf-8") as f:
+        return [record["history"] for record in map(json.loads, f) if record.get("history")]
+
+
+def evaluate(histories, detector, calls_per_round=4, fused=False):
+    """按 end 模式回放已记录的会话：在检测器首次报警的轮次结束会话，统计能省下的 LLM 调用。
+    拆分模式下报警当轮的 Strategist 调用也省去；合并模式下只用之前各轮的 Mᵢ。"""
+    total_rounds = total_calls = saved_calls = flagged_sessions = natural_end_later = 0
+    statuses = {STAGNANT: 0, CONVERGED: 0}
+    for history in histories:
+        total_rounds += len(history)
+        total_calls += len(history) * calls_per_round
+        for i, current in enumerate(history):
+            memory = None if fused else current.get("memory_summary")
+            assessment = detector.assess(history[:i], current, memory)
+            if not assessment.flagged:
+                continue
+            flagged_sessions += 1
+            statuses[assessment.status] += 1
+            saved_calls += (len(history) - 1 - i) * calls_per_round + (0 if fused else 1)
+            if str(history[-1].get("progression_directives", {}).get("is_end", "")).lower() == "yes":
+                natural_end_later += 1
+            break
+    return {
+        "thresholds": {"thought": detector.thought, "memory": detector.memory, "window": detector.window,
+                       "min_rounds": detector.min_rounds},
+        "sessions": len(histories),
+        "flagged_sessions": flagged_sessions,
+        "by_status": statuses,
+        # 报警的会话中，Strategist 后来自己给出 is_end=Yes 的比例；越高说明提前结束越不冒进
+        "flagged_later_ended_by_strategist": round(natural_end_later / flagged_sessions, 3) if flagged_sessions else None,
+        "rounds": total_rounds,
+        "llm_calls": total_calls,
+        "llm_calls_saved": saved_calls,
+        "llm_calls_saved_ratio": round(saved_calls / total_calls, 3) if total_calls else 0.0,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="MIND 会话收敛检测")
+    sub = parser.add_subparsers(dest="command", required=True)
+    eval_parser = sub.add_parser("eval", help="在已记录的会话上评估能省下的 LLM 调用")
+    eval_parser.add_argument("path", help="mind_simulate.py 输出的 JSONL")
+    eval_parser.add_argument("--thresholds", default="", help='例如 "thought=0.6,memory=0.7,window=2,min_rounds=3"')
+    eval_parser.add_argument("--calls-per-round", type=int, default=4, help="拆分模式 4 次，合并模式 2 次")
+    eval_parser.add_argument("--fused", action="store_true", help="按合并调用模式回放 (报警时还没有本轮的 Mᵢ)")
+    eval_parser.add_argument("--sweep", action="store_true", help="遍历一组阈值组合")
+    args = parser.parse_args(argv)
+
+    histories = load_histories(args.path)
+    base = {**DEFAULT_THRESHOLDS, **parse_thresholds(args.thresholds)}
+    if args.sweep:
+        grid = [{**base, "thought": t, "memory": m} for t in (0.5, 0.6, 0.7, 0.8) for m in (0.6, 0.7, 0.8, 0.9)]
+    else:
+        grid = [base]
+    for thresholds in grid:
+        report = evaluate(histories, ConvergenceDetector("end", **thresholds), args.calls_per_round, args.fused)
+        print(json.dumps(report, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
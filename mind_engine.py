@@ -0,0 +1,423 @@
+"""与界面无关的 MIND 会话引擎：Trigger → Devil → Guide → Strategist 的单轮逻辑与整场会话循环。
+
+Streamlit 界面 (mind_cn_web_demo.py) 与批量模拟器 (mind_simulate.py) 共用这里的逻辑。
+会话状态对象只需具备 session_id / theme / concern / personality_traits / current_round / history /
+last_progression 这些属性，st.session_state 与 SessionState 都满足。
+每次 Agent 调用记录一个 span (mind_tracing)；会话 id 与轮次由调用方通过 trace_context 提供。
+fused=True (MIND_PIPELINE=fused) 时每轮只发两次请求：Trigger+Devil 合并、Guide+Strategist 合并，
+产出与四次调用相同结构的 current_data。
+调用 Strategist 前由 mind_convergence 检测对话是否陷入循环或已收敛，结果作为建议交给 Strategist 或直接结束会话。
+JSON 输出按 mind_parsing 中各 Agent 的 schema 解析并在本地修复；仍缺少的必填字段只针对这些字段补问一次
+(MIND_FIELD_RETRY=0 关闭)，之后才使用占位内容。
+"""
+import os
+
+from mind_convergence import ConvergenceDetector, convergence_progression
+from mind_history import HistoryLog
+from mind_llm import SYSTEM_ROLES, logger
+from mind_parsing import (
+    SCHEMAS, IncrementalJSONArray, guide_fields, has_field, parse_output, partial_json_field, progression_fields,
+    scene_thought_fields, stream_text,
+)
+from mind_prompts import PROMPTS
+from mind_tracing import trace_context
+
+THEME_OPTIONS = [
+    "工作问题 (Work issues)", "随机负面事件 (Random negative events)",
+    "人际关系问题 (Interpersonal issues)", "经济问题 (Economic issues)",
+    "家庭问题 (Family issues)", "身体压力 (Physical stress)",
+    "理想与现实的差距 (Discrepancy between ideal and reality)"
+]
+DEFAULT_PERSONALITY = "偏内向，有一定程度的尽责性"
+C2D2_TOP_K = 3
+# Guide 的确定性模式：MIND_GUIDE_TEMPERATURE=0 时输出可复现，其结果可被缓存；未设置时使用路由表中的 temperature
+_guide_temperature = os.getenv("MIND_GUIDE_TEMPERATURE")
+GUIDE_TEMPERATURE = float(_guide_temperature) if _guide_temperature else None
+# local: 用 C2D2 训练的本地分类器逐轮标注 Dᵢ；llm: 沿用 devil_0 的 Type 输出并在后续轮次继承
+DEVIL_TYPE_SOURCE = os.getenv("MIND_DEVIL_TYPE", "local")
+# split: 每轮四次调用 (默认)；fused: 每轮两次合并调用
+PIPELINE_MODE = os.getenv("MIND_PIPELINE", "split")
+# JSON 输出本地修复后仍缺少必填字段时，是否只针对缺失字段补问一次
+FIELD_RETRY = os.getenv("MIND_FIELD_RETRY", "1") != "0"
+
+
+def default_progression():
+    return {
+        "next_scene_directive": "生成反映初始担忧和主题的场景",
+        "next_thought_directive": "产生与担忧相关的初始认知扭曲",
+        "is_end": "No"
+    }
+
+
+def opening_progression(theme, concern):
+    return {
+        "next_scene_directive": f"围绕主题'{theme}'和用户担忧'{concern[:20]}...'生成初始场景",
+        "next_thought_directive": f"基于担忧'{concern[:20]}...'产生与主题'{theme}'相关的初始认知扭曲",
+        "is_end": "No"
+    }
+
+
+def _normalize_type(label):
+    from mind_classifier import normalize_type
+
+    return normalize_type(label)
+
+
+def local_memory_summary(current_data):
+    """Guide 没有给出 Mᵢ 时用本轮的场景与想法拼出记忆总结，不把占位文字交给 Strategist。"""
+    return (f"场景：{current_data.get('scene', '无')}；想法：{current_data.get('devil_thoughts', '无')}"
+            f"；类型：{current_data.get('devil_type', '未知')}")
+
+
+def is_end(progression):
+    return str(progression.get("is_end", "No")).lower() == "yes"
+
+
+class SessionState:
+    """无界面运行时的会话状态，字段与 Streamlit session_state 中的同名键一致。"""
+
+    def __init__(self, theme, concern, personality_traits=DEFAULT_PERSONALITY, session_id=None):
+        self.session_id = session_id
+        self.theme = theme
+        self.concern = concern
+        self.personality_traits = personality_traits
+        self.current_round = 1
+        self.history = HistoryLog()
+        self.last_progression = opening_progression(theme, concern)
+        self.finished = False
+
+
+class SessionEngine:
+    """index/classifier 可为 None (不使用 C2D2 种子 / 改用 LLM 标注类型)；on_error 接收面向用户的错误信息。
+    convergence 为 mind_convergence.ConvergenceDetector，None 时按 MIND_CONVERGENCE 创建，False 关闭检测。"""
+
+    def __init__(self, llm, index=None, classifier=None, on_error=None, stream=False, fused=None, convergence=None):
+        self.llm = llm
+        self.index = index
+        self.classifier = classifier
+        self.on_error = on_error or logger.error
+        self.stream = stream
+        self.fused = PIPELINE_MODE == "fused" if fused is None else fused
+        self.convergence = ConvergenceDetector.from_env() if convergence is None else (convergence or None)
+
+    # --- 辅助 ---
+    def c2d2_examples(self, query, with_thought=True):
+        if self.index is None:
+            return "无"
+        # 种子案例只取带认知扭曲标签的记录
+        from mind_c2d2 import format_examples # mind_c2d2 / mind_classifier 依赖 numpy，用到时再导入，不拖慢首屏
+
+        return format_examples(self.index.search(query, k=C2D2_TOP_K, exclude_labels=("非扭曲",)), with_thought)
+
+    def local_type_enabled(self):
+        return DEVIL_TYPE_SOURCE == "local" and self.classifier is not None
+
+    def _text_agent(self, template_id, variables, key, render=None, extra_keys=()):
+        """调用 Trigger/Devil 等文本型 Agent；流式模式下边生成边把 key 字段交给 render。"""
+        prompt = PROMPTS[template_id]
+        system_role = SYSTEM_ROLES[prompt.agent]
+        with self.llm.tracer.span(prompt.agent, template_id) as span:
+            if self.stream and render is not None:
+                chunks = self.llm.call(prompt, variables, system_role, stream=True, on_error=self.on_error)
+                raw = stream_text(chunks, key, render)
+            else:
+                raw = self.llm.call(prompt, variables, system_role, on_error=self.on_error)
+            # 缺少 `Key:` 时 parse_output 会退回整段文本或最后一行
+            missing = [k for k in (key, *extra_keys) if not has_field(raw, k)]
+            span.parse_fallback = ",".join(missing) or None
+        return raw
+
+    def _parse_json(self, template_id, variables, raw, span, on_error=None):
+        """按该 Agent 的 schema 解析 JSON 输出 (含本地修复)。仍缺少必填字段且这次调用本身没有出错时，
+        只针对缺失字段补问一次；补问记为同一 Agent 的单独一次调用 (template_id 为 "<agent>_repair")。"""
+        prompt = PROMPTS[template_id]
+        schema = SCHEMAS[prompt.agent]
+        parsed = schema.parse(raw)
+        span.repairs = ",".join(parsed.repairs) or None
+        if parsed.missing and FIELD_RETRY and span.error is None:
+            repair_id = f"{prompt.agent}_repair"
+            repair_variables = {
+                "missing_fields": "、".join(parsed.missing),
+                "field_format": schema.skeleton(parsed.missing),
+                "task": prompt.render(variables, strict=True).text.strip(),
+                "previous_output": raw or "无",
+            }
+            with self.llm.tracer.span(prompt.agent, repair_id) as retry_span:
+                retry_span.field_retry = ",".join(parsed.missing)
+                retry_raw = self.llm.call(PROMPTS[repair_id], repair_variables, SYSTEM_ROLES[prompt.agent],
+                                          response_format="json_object", on_error=on_error or self.on_error)
+                # 补问失败时 retry_raw 是占位 JSON，不能用来填补字段
+                if retry_span.error is None:
+                    parsed = parsed.merge(schema.parse(retry_raw))
+        span.parse_fallback = ",".join(parsed.missing) or None
+        return parsed
+
+    # --- 生成 Sᵢ, Dᵢ ---
+    def generate_scene_and_thought(self, state, render_scene=None, render_devil=None):
+        """执行本轮 Trigger 与 Devil，返回 current_data。"""
+        if self.fused:
+            return self._fused_scene_and_thought(state, render_scene, render_devil)
+        round_num = state.current_round
+        theme = state.theme
+        concern = state.concern # Needed only for round 1 Devil
+        history = state.history
+        last_progression = state.last_progression
+        personality_traits = state.personality_traits
+
+        # --- 生成 S 和 D (首轮以 C2D2 相似案例为种子) ---
+        if round_num == 1:
+            # 调用 Trigger (生成 S₀)
+            variables_trigger = {"theme": theme, "concerns": concern, "c2d2_examples": self.c2d2_examples(f"{theme} {concern}", with_thought=False)}
+            scene_raw = self._text_agent("trigger_0", variables_trigger, "Scene", render_scene)
+            scene = parse_output(scene_raw or "场景生成失败", "Scene")
+
+            # 调用 Devil (生成 D₀ 和 Type)
+            variables_devil = {
+                "scene": scene, "concerns": concern, "personality_traits": personality_traits,
+                "c2d2_examples": self.c2d2_examples(f"{scene} {concern}")
+            }
+            use_local_type = self.local_type_enabled()
+            devil_template = "devil_0" if use_local_type else "devil_0_typed"
+            devil_raw = self._text_agent(devil_template, variables_devil, "Thoughts", render_devil,
+                                         extra_keys=() if use_local_type else ("Type",))
+            devil_thoughts = parse_output(devil_raw or "想法生成失败", "Thoughts")
+            if use_local_type:
+                devil_type = self.classifier.predict_one(devil_thoughts)
+            else:
+                # Parse the type generated by LLM, normalised to the C2D2 label set when possible
+                llm_type = parse_output(devil_raw or "", "Type")
+                devil_type = _normalize_type(llm_type) or llm_type
+
+        else: # 后续轮次 (i > 1)
+            # 调用 Trigger (生成 Sᵢ)
+            variables_trigger = {
+                "theme": theme,
+                "comfort_prev": history[-1].get("player_comfort", "无"),
+                "directive_scene": last_progression.get("next_scene_directive", "无特定指导")
+            }
+            scene_raw = self._text_agent("trigger_i", variables_trigger, "Scene", render_scene)
+            scene = parse_output(scene_raw or "场景生成失败", "Scene")
+
+            # 调用 Devil (生成 Dᵢ)
+            variables_devil = {
+                "scene": scene,
+                "personality_traits": personality_traits,
+                "type_prev": history[-1].get("devil_type", "未知"), # Use previous type as context
+                "thought_prev": history[-1].get("devil_thoughts", "无"),
+                "comfort_prev": history[-1].get("player_comfort", "无"),
+                "directive_thought": last_progression.get("next_thought_directive", "无特定指导")
+            }
+            devil_raw = self._text_agent("devil_i", variables_devil, "Thoughts", render_devil)
+            devil_thoughts = parse_output(devil_raw or "想法生成失败", "Thoughts")
+            if self.local_type_enabled():
+                # 每轮重新标注，类型可以随思想演变 (包括变为 "非扭曲")
+                devil_type = self.classifier.predict_one(devil_thoughts)
+            else:
+                # Type is inherited or guided by Strategist
+                devil_type = history[-1].get("devil_type", "未知")
+
+        return {
+            "round": round_num,
+            "theme": theme,
+            "scene": scene,
+            "devil_type": devil_type,
+            "devil_thoughts": devil_thoughts,
+        }
+
+    def _fused_scene_and_thought(self, state, render_scene=None, render_devil=None):
+        """一次请求生成 Sᵢ、Dᵢ 与 Type；流式模式下 scene / thoughts 字段边生成边显示。"""
+        round_num = state.current_round
+        history = state.history
+        if round_num == 1:
+            template_id = "scene-thought_0"
+            variables = {
+                "theme": state.theme, "concerns": state.concern, "personality_traits": state.personality_traits,
+                "c2d2_examples": self.c2d2_examples(f"{state.theme} {state.concern}"),
+            }
+        else:
+            template_id = "scene-thought_i"
+            variables = {
+                "theme": state.theme,
+                "directive_scene": state.last_progression.get("next_scene_directive", "无特定指导"),
+                "directive_thought": state.last_progression.get("next_thought_directive", "无特定指导"),
+                "personality_traits": state.personality_traits,
+                "type_prev": history[-1].get("devil_type", "未知"),
+                "thought_prev": history[-1].get("devil_thoughts", "无"),
+                "comfort_prev": history[-1].get("player_comfort", "无"),
+            }
+        prompt = PROMPTS[template_id]
+        with self.llm.tracer.span(prompt.agent, template_id) as span:
+            args = (prompt, variables, SYSTEM_ROLES[prompt.agent])
+            if self.stream and (render_scene or render_devil):
+                raw = ""
+                for delta in self.llm.call(*args, response_format="json_object", stream=True, on_error=self.on_error):
+                    raw += delta
+                    for key, render in (("scene", render_scene), ("thoughts", render_devil)):
+                        value = render and partial_json_field(raw, key)
+                        if value:
+                            render(value)
+            else:
+                raw = self.llm.call(*args, response_format="json_object", on_error=self.on_error)
+            if isinstance(raw, str) and "{" not in raw and has_field(raw, "Scene") and has_field(raw, "Thoughts"):
+                # 没有按 JSON 输出但给出了 `Scene:` / `Thoughts:`，按文本解析即可，不必补问
+                span.repairs = "text"
+                scene, devil_thoughts = parse_output(raw, "Scene"), parse_output(raw, "Thoughts")
+                llm_type = parse_output(raw, "Type") if has_field(raw, "Type") else None
+                error = None
+            else:
+                scene, devil_thoughts, llm_type, error = scene_thought_fields(
+                    self._parse_json(template_id, variables, raw, span), raw)
+        if error:
+            self.on_error(error)
+
+        if self.local_type_enabled():
+            devil_type = self.classifier.predict_one(devil_thoughts)
+        elif llm_type:
+            devil_type = _normalize_type(llm_type) or llm_type
+        else:
+            devil_type = history[-1].get("devil_type", "未知") if history else "未知"
+        return {
+            "round": round_num,
+            "theme": state.theme,
+            "scene": scene,
+            "devil_type": devil_type,
+            "devil_thoughts": devil_thoughts,
+        }
+
+    # --- Guide (Gᵢ, Mᵢ) ---
+    @staticmethod
+    def guide_variables(current_data):
+        return {
+            "scene": current_data["scene"],
+            "thoughts": current_data["devil_thoughts"],
+            "type": current_data.get("devil_type", "未知") # Pass the type to Guide
+        }
+
+    def request_guide(self, current_data, raise_errors=False, on_suggestion=None, on_partial=None, on_error=None):
+        """请求并解析 Guide 输出，返回 (guide_suggestions, memory_summary, error)。
+        流式模式下每条建议到齐即回调 on_suggestion，未完成的部分回调 on_partial。
+        on_error 覆盖引擎的错误回调 (例如在没有界面上下文的后台线程中预取时)。"""
+        on_error = on_error or self.on_error
+        prompt = PROMPTS["guide"]
+        variables = self.guide_variables(current_data)
+        args = (prompt, variables, SYSTEM_ROLES["guide"])
+        kwargs = {"response_format": "json_object", "raise_errors": raise_errors,
+                  "temperature": GUIDE_TEMPERATURE, "on_error": on_error}
+        with self.llm.tracer.span("guide", "guide") as span:
+            if not (self.stream and on_suggestion):
+                guide_raw = self.llm.call(*args, **kwargs)
+            else:
+                # 建议数组中的每一条一到齐就回调，无需等待整个 JSON 闭合
+                suggestions_stream = IncrementalJSONArray("guidance_suggestions")
+                guide_raw = ""
+                for delta in self.llm.call(*args, stream=True, **kwargs):
+                    guide_raw += delta
+                    for sug in suggestions_stream.feed(delta):
+                        on_suggestion(sug)
+                    if on_partial:
+                        pending = suggestions_stream.partial()
+                        if pending:
+                            on_partial(pending)
+            parsed = self._parse_json("guide", variables, guide_raw, span, on_error)
+        guide_suggestions, memory_summary_curr, error = guide_fields(parsed, guide_raw)
+        if "memory_summary_curr" in parsed.missing:
+            memory_summary_curr = local_memory_summary(current_data)
+        return guide_suggestions, memory_summary_curr, error
+
+    def run_guide(self, current_data, prefetched=None, **stream_callbacks):
+        """返回 (guide_suggestions, memory_summary)；prefetched 为预取的 request_guide 结果时不再请求。"""
+        if prefetched is None:
+            prefetched = self.request_guide(current_data, **stream_callbacks)
+        guide_suggestions, memory_summary_curr, error = prefetched
+        if error:
+            self.on_error(error)
+        return guide_suggestions, memory_summary_curr
+
+    # --- 收敛检测 ---
+    def assess_convergence(self, state, current_data, memory_summary_curr=None):
+        """在调用 Strategist 之前检测对话是否停滞或收敛；未开启检测时返回 None。"""
+        if self.convergence is None:
+            return None
+        return self.convergence.assess(state.history, current_data, memory_summary_curr)
+
+    # --- Strategist (Pᵢ) ---
+    def run_strategist(self, memory_summary_curr, player_comfort, assessment=None):
+        """assessment 为 assess_convergence 的结果：end 模式下报警时不再调用 Strategist，直接结束会话。"""
+        if self.convergence is not None and self.convergence.should_end(assessment):
+            return convergence_progression(assessment)
+        variables = {
+            "memory_summary_curr": memory_summary_curr,
+            "comfort_curr": player_comfort,
+            "convergence_note": assessment.note() if assessment else "无",
+        }
+        with self.llm.tracer.span("strategist", "strategist") as span:
+            strategist_raw = self.llm.call(PROMPTS["strategist"], variables, SYSTEM_ROLES["strategist"],
+                                           response_format="json_object", on_error=self.on_error)
+            progression_directives, error = progression_fields(
+                self._parse_json("strategist", variables, strategist_raw, span), strategist_raw)
+        if error:
+            self.on_error(error)
+        return progression_directives
+
+    # --- 合并调用：Guide + Strategist (Gᵢ, Mᵢ, Pᵢ) ---
+    def run_guide_and_strategist(self, current_data, player_comfort, assessment=None):
+        """一次请求生成 Gᵢ、Mᵢ 与 Pᵢ，返回 (guide_suggestions, memory_summary, progression_directives)。
+        本轮的 Mᵢ 与 Pᵢ 同时生成，end 模式下报警时仍需这次请求，只把规划改为结束。"""
+        variables = {**self.guide_variables(current_data), "comfort_curr": player_comfort,
+                     "convergence_note": assessment.note() if assessment else "无"}
+        prompt = PROMPTS["guide-strategist"]
+        with self.llm.tracer.span(prompt.agent, "guide-strategist") as span:
+            raw = self.llm.call(prompt, variables, SYSTEM_ROLES[prompt.agent], response_format="json_object",
+                                temperature=GUIDE_TEMPERATURE, on_error=self.on_error)
+            parsed = self._parse_json("guide-strategist", variables, raw, span)
+        guide_suggestions, memory_summary_curr, guide_error = guide_fields(parsed, raw)
+        progression_directives, strategist_error = progression_fields(parsed, raw)
+        if "memory_summary_curr" in parsed.missing:
+            memory_summary_curr = local_memory_summary(current_data)
+        error = guide_error or strategist_error
+        if error:
+            self.on_error(error)
+        if self.convergence is not None and self.convergence.should_end(assessment):
+            progression_directives = {**progression_directives, **convergence_progression(assessment)}
+        return guide_suggestions, memory_summary_curr, progression_directives
+
+    # --- 回合收尾 ---
+    @staticmethod
+    def record_round(state, current_data, progression_directives):
+        """把完成的回合写入 history (转为紧凑的 RoundRecord)，更新 Pᵢ；返回会话是否结束。"""
+        current_data["progression_directives"] = progression_directives
+        # 存入 history
+        state.history.append(current_data)
+        # 更新 Pᵢ 用于下一轮
+        state.last_progression = progression_directives
+        if is_end(progression_directives):
+            return True
+        state.current_round += 1
+        return False
+
+    def run_round(self, state, player):
+        """无界面执行一整轮；player(state, current_data) 返回本轮安慰 Cᵢ。返回是否结束。"""
+        with trace_context(state.session_id, state.current_round):
+            return self._run_round(state, player)
+
+    def _run_round(self, state, player):
+        current_data = self.generate_scene_and_thought(state)
+        player_comfort = player(state, current_data)
+        current_data["player_comfort"] = player_comfort # Cᵢ
+        if self.fused:
+            assessment = self.assess_convergence(state, current_data)
+            guide_suggestions, memory_summary_curr, progression_directives = self.run_guide_and_strategist(
+                current_data, player_comfort, assessment)
+        else:
+            guide_suggestions, memory_summary_curr = self.run_guide(current_data)
+            assessment = self.assess_convergence(state, current_data, memory_summary_curr)
+            progression_directives = self.run_strategist(memory_summary_curr, player_comfort, assessment)
+        current_data["guide_suggestions"] = guide_suggestions
+        current_data["memory_summary"] = memory_summary_curr
+        return self.record_round(state, current_data, progression_directives)
+
+    def run_session(self, state, player, max_rounds=20):
+        """运行到 Strategist (或收敛检测) 判定 is_end 或达到 max_rounds 为止。"""
+        while not state.finished and state.current_round <= max_rounds:
+            state.finished = self.run_round(state, player)
+        return state
@@ -0,0 +1,152 @@
+"""会话历史：每轮一个紧凑的 RoundRecord (__slots__)，HistoryLog 只在内存中保留最近 window 轮。
+
+HistoryLog 支持 history[-1]、len()、迭代与切片，记录支持 r["scene"] / r.get("scene")，
+因此引擎、界面与模拟器中按下标和键读取历史的代码无需改动。移出窗口的回合通过 loader 按需读取
+(例如从持久化存储)；没有 loader 时回合无处可取，全部保留在内存中，不受 window 限制。
+设置了 saved 时只移出已经保存的回合 (saved() 为从第一轮起已保存的回合数)，保存失败的回合留在内存中。
+
+环境变量:
+    MIND_HISTORY_WINDOW=64   设置了 loader 时内存中保留的最近回合数
+"""
+import os
+import threading
+from collections import deque
+from itertools import islice
+
+HISTORY_WINDOW = int(os.getenv("MIND_HISTORY_WINDOW", "64"))
+
+
+class RoundRecord:
+    """一轮的 Sᵢ / Dᵢ / Gᵢ / Mᵢ / Cᵢ / Pᵢ。"""
+    __slots__ = ("round", "theme", "scene", "devil_type", "devil_thoughts", "guide_suggestions", "memory_summary",
+                 "player_comfort", "progression_directives")
+
+    def __init__(self, round, theme=None, scene=None, devil_type=None, devil_thoughts=None, guide_suggestions=(),
+                 memory_summary=None, player_comfort=None, progression_directives=None):
+        self.round = round
+        self.theme = theme
+        self.scene = scene
+        self.devil_type = devil_type
+        self.devil_thoughts = devil_thoughts
+        self.guide_suggestions = tuple(guide_suggestions) if isinstance(guide_suggestions, (list, tuple)) else guide_suggestions
+        self.memory_summary = memory_summary
+        self.player_comfort = player_comfort
+        self.progression_directives = progression_directives or {}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def to_dict(self):
+        record = {name: getattr(self, name) for name in self.__slots__}
+        record["guide_suggestions"] = list(self.guide_suggestions) if isinstance(self.guide_suggestions, tuple) else self.guide_suggestions
+        return record
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"RoundRecord(round={self.round!r})"
+
+
+class HistoryLog:
+    """只追加的回合日志。下标按整场会话的回合顺序计 (0 为第一轮)，len() 为总回合数。
+    只有设置了 loader 才会把超出 window 的旧回合移出内存，设置了 saved 时只移出已保存的回合。"""
+
+    def __init__(self, records=(), window=None, loader=None, saved=None):
+        self.window = window or HISTORY_WINDOW
+        self._records = deque()
+        self._evicted = 0 # 已移出内存窗口的回合数
+        self.loader = loader # loader(start, stop) -> [RoundRecord]，读取窗口之外的回合
+        self.saved = saved # saved() -> 从第一轮起 loader 能读到的回合数；为 None 时视为全部可读
+        self._lock = threading.Lock() # 空闲清理线程会调用 evict()
+        for record in records:
+            self.append(record)
+
+    @classmethod
+    def lazy(cls, count, loader, window=None, saved=None):
+        """已有 count 轮保存在别处 (由 loader 读取)、内存中暂无回合的日志，用于恢复会话。"""
+        log = cls(window=window, loader=loader, saved=saved)
+        log._evicted = count
+        return log
+
+    def append(self, record):
+        if not isinstance(record, RoundRecord):
+            record = RoundRecord.from_dict(record)
+        with self._lock:
+            if len(self._records) >= self.window and self._evictable() > 0:
+                self._records.popleft()
+                self._evicted += 1
+            self._records.append(record)
+        return record
+
+    def _evictable(self):
+        # 持有 _lock 时调用：内存中从最早一轮起可以移出 (loader 能读回) 的回合数
+        if self.loader is None:
+            return 0
+        if self.saved is None:
+            return len(self._records)
+        return max(0, min(len(self._records), self.saved() - self._evicted))
+
+    def evict(self):
+        """把内存中已保存的回合移出 (需设置 loader)，返回移出的回合数。"""
+        with self._lock:
+            count = self._evictable()
+            for _ in range(count):
+                self._records.popleft()
+            self._evicted += count
+        return count
+
+    def __len__(self):
+        return self._evicted + len(self._records)
+
+    def __bool__(self):
+        return bool(self._records) or self._evicted > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return self.page(start, stop)
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        with self._lock:
+            if index >= self._evicted:
+                return self._records[index - self._evicted]
+        records = self.page(index, index + 1)
+        if not records:
+            raise IndexError(f"第 {index + 1} 轮已移出内存窗口")
+        with self._lock:
+            # 最近移出的一轮 (通常是 history[-1]) 读回后重新放入窗口，之后不必每次访问都查存储
+            if index == self._evicted - 1 and len(self._records) < self.window:
+                self._records.appendleft(records[0])
+                self._evicted -= 1
+        return records[0]
+
+    def __iter__(self):
+        return iter(self.page(0, len(self)))
+
+    def page(self, start, stop):
+        """第 start 到 stop-1 个回合 (按时间顺序)；窗口之外且没有 loader 的回合被略过。"""
+        with self._lock:
+            evicted = self._evicted
+            stop = min(stop, evicted + len(self._records))
+            lo = max(start, evicted) - evicted
+            hi = stop - evicted
+            in_memory = list(islice(self._records, lo, hi)) if hi > lo else []
+        records = []
+        if start < evicted and self.loader is not None:
+            records.extend(self.loader(start, min(stop, evicted)))
+        return records + in_memory
+
+    def to_list(self):
+        return [record.to_dict() for record in self]
@@ -0,0 +1,294 @@
+"""与界面无关的 LLM 调用层：按 Agent 路由模型、渲染提示词、查询响应缓存、限流、容错重试、记录调用 span，并支持流式输出。"""
+import json
+import logging
+import os
+import time
+from contextlib import ExitStack, nullcontext
+
+from mind_cache import make_key
+from mind_prompts import PromptTemplate, compile_adhoc, estimate_tokens
+from mind_resilience import DeadlineExceeded
+from mind_scheduler import INTERACTIVE
+from mind_tracing import Tracer, current_span
+
+logger = logging.getLogger("mind")
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_TEMPERATURE = 0.7
+
+SYSTEM_ROLES = {
+    "trigger": "你是情境再现师 (Trigger, τ)",
+    "devil": "你是模拟认知扭曲的患者 (Devil, δ)",
+    "guide": "你是心理指导师 (Guide, g)",
+    "strategist": "你是故事策划和情节控制师 (Strategist, ς)",
+    # 合并调用模式
+    "scene-thought": "你是情境再现师 (Trigger, τ) 兼模拟认知扭曲的患者 (Devil, δ)",
+    "guide-strategist": "你是心理指导师 (Guide, g) 兼故事策划和情节控制师 (Strategist, ς)",
+}
+
+
+def error_fallback(e, system_role, response_format=None):
+    # 返回错误信息 JSON 或文本。JSON 中不含任何 Agent 字段，由引擎按缺失字段使用默认规划、
+    # 本地生成的记忆总结等兜底内容，避免把 "错误" 当作有效指令传给下一轮
+    if response_format == "json_object":
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    return f"错误: {e}"
+
+
+def make_client(api_key=None, base_url=None):
+    """创建带连接池的 OpenAI 客户端，供同一进程内的所有会话共用 (复用 keep-alive 连接与 TLS 会话)。
+
+    环境变量: MIND_HTTP_MAX_CONNECTIONS=64   MIND_HTTP_MAX_KEEPALIVE=32   MIND_HTTP_KEEPALIVE_EXPIRY=60
+    MIND_HTTP_TIMEOUT=60   MIND_HTTP_CONNECT_TIMEOUT=5
+    """
+    import httpx
+    from openai import DefaultHttpxClient, OpenAI
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("MIND_HTTP_MAX_CONNECTIONS", "64")),
+        max_keepalive_connections=int(os.getenv("MIND_HTTP_MAX_KEEPALIVE", "32")),
+        keepalive_expiry=float(os.getenv("MIND_HTTP_KEEPALIVE_EXPIRY", "60")),
+    )
+    timeout = httpx.Timeout(float(os.getenv("MIND_HTTP_TIMEOUT", "60")),
+                            connect=float(os.getenv("MIND_HTTP_CONNECT_TIMEOUT", "5")))
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=timeout,
+                  http_client=DefaultHttpxClient(limits=limits, timeout=timeout))
+
+
+def warm_up(client, timeout=5.0):
+    """预先建立到 API 的连接 (DNS + TCP + TLS) 并留在连接池中，之后的首个请求不再付建连开销。
+    请求的是不计费的 GET /models；任何 HTTP 响应 (包括 401) 都说明连接已建立，网络错误时忽略。"""
+    import httpx
+
+    started = time.perf_counter()
+    try:
+        client.with_options(max_retries=0, timeout=timeout).get("/models", cast_to=httpx.Response)
+    except Exception as e:
+        if getattr(e, "status_code", None) is None: # 有状态码说明连接已经建立
+            logger.info(f"API 连接预热失败: {e}")
+            return None
+    return time.perf_counter() - started
+
+
+def _log_error(message):
+    logger.error(message)
+
+
+class LLM:
+    """包装 OpenAI 兼容客户端；cache 为 mind_cache.ResponseCache，limiter 为 mind_ratelimit.RateLimiter，
+    tracer 为 mind_tracing.Tracer，resilience 为 mind_resilience.ResiliencePolicy，router 为 mind_routing.Router，
+    scheduler 为 mind_scheduler.FairScheduler (均可选)。
+    设置 resilience 后由它负责时限与重试，客户端自身的重试被关闭；设置 router 后按 Agent 选择模型、
+    temperature 与 max_tokens，否则所有 Agent 都使用 model。设置 scheduler 后每个请求先按会话公平排队，
+    priority 为 mind_scheduler.INTERACTIVE 或 BACKGROUND。"""
+
+    def __init__(self, client, cache=None, model=DEFAULT_MODEL, limiter=None, tracer=None, resilience=None, router=None,
+                 scheduler=None, priority=INTERACTIVE):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.limiter = limiter
+        self.tracer = tracer or Tracer()
+        self.resilience = resilience
+        self.router = router
+        self.scheduler = scheduler
+        self.priority = priority
+
+    # prompt 为 mind_prompts 中编译好的 PromptTemplate (也接受临时的模板字符串，但不走缓存)
+    # 登记过的模板严格渲染：variables 缺少模板中的变量时抛出 MissingVariableError，不再静默填充
+    # stream=True 时返回一个生成器，逐段 yield 模型输出的文本增量
+    # raise_errors=True 时把异常抛给调用方；否则交给 on_error 并返回符合结构的占位输出
+    # 调用信息写入调用方通过 tracer.span() 打开的 span；没有时自行记录一个 span
+    # temperature 为 None 时使用路由表中该 Agent 的设置
+    def call(self, prompt, variables, system_role="你是一个助手", response_format=None, stream=False,
+             raise_errors=False, temperature=None, on_error=None):
+        if not isinstance(prompt, PromptTemplate):
+            prompt = compile_adhoc(prompt)
+        rendered = prompt.render(variables, strict=prompt.template_id is not None)
+        on_error = on_error or _log_error
+
+        agent = prompt.agent
+        span = current_span()
+        owned = span is None
+        if owned:
+            span = self.tracer.start(agent, prompt.template_id)
+        if rendered.trimmed:
+            span.trimmed = ",".join(rendered.trimmed)
+        if rendered.missing:
+            span.missing_vars = ",".join(rendered.missing)
+
+        model, max_tokens = self.model, None
+        if self.router is not None:
+            route, span.route = self.router.route(agent, span.session_id)
+            model, max_tokens = route.model, route.max_tokens
+            if temperature is None:
+                temperature = route.temperature
+        if temperature is None:
+            temperature = DEFAULT_TEMPERATURE
+        span.model = model
+
+        messages = [
+            {"role": "system", "content": system_role},
+            {"role": "user", "content": rendered.text}
+        ]
+        completion_args = {
+            "model": model,
+            "temperature": temperature,
+            "messages": messages
+        }
+        if max_tokens:
+            completion_args["max_tokens"] = max_tokens
+        if response_format == "json_object":
+            completion_args["response_format"] = {"type": "json_object"}
+
+        cache_key = None
+        if self.cache is not None and self.cache.enabled_for(agent, temperature):
+            cache_key = make_key(prompt.template_id, rendered.text, system_role, model, temperature, response_format,
+                                 max_tokens)
+            cached = self.cache.get(agent, cache_key)
+            if cached is not None:
+                span.cache_hit = True
+                span.mark_first_token()
+                if owned:
+                    self.tracer.emit(span)
+                return iter([cached]) if stream else cached
+
+        if stream:
+            return self._stream(agent, completion_args, rendered, system_role, response_format, cache_key,
+                                raise_errors, on_error, span, owned)
+
+        started = time.perf_counter()
+        try:
+            if self.resilience is None:
+                completion = self._complete(completion_args, model, rendered, span)
+            else:
+                completion = self.resilience.execute(
+                    agent, model,
+                    lambda chosen, timeout: self._complete(completion_args, chosen, rendered, span, timeout), span)
+            span.mark_first_token()
+            content = completion.choices[0].message.content
+            span.set_usage(completion.usage, rendered.tokens, estimate_tokens(content or ""))
+            # 达到 max_tokens 被截断的输出不缓存
+            if cache_key and content and completion.choices[0].finish_reason != "length":
+                self.cache.set(cache_key, content)
+            return content
+        except Exception as e:
+            span.error = repr(e)
+            if raise_errors:
+                raise
+            on_error(f"调用 GPT 时出错: {e}")
+            return error_fallback(e, system_role, response_format)
+        finally:
+            self._observe(agent, span, started)
+            if owned:
+                self.tracer.emit(span)
+
+    def _observe(self, agent, span, started):
+        # 把本次调用的耗时、成败与费用回报给动态路由
+        if self.router is not None:
+            self.router.observe(agent, span.model, time.perf_counter() - started, span.error is None,
+                                span.cost_usd or 0.0, span.session_id)
+
+    def _slot(self, rendered, span):
+        # 先在调度器中排队获得并发名额，再按限流器的 RPM/TPM 预算放行
+        if self.scheduler is None and self.limiter is None:
+            return nullcontext()
+        stack = ExitStack()
+        with stack:
+            if self.scheduler is not None:
+                stack.enter_context(self.scheduler.slot(span.session_id, self.priority))
+            if self.limiter is not None:
+                stack.enter_context(self.limiter.request(rendered.tokens))
+            return stack.pop_all()
+
+    def _client_for(self, timeout):
+        if timeout is None:
+            return self.client
+        return self.client.with_options(max_retries=0, timeout=timeout)
+
+    def _complete(self, completion_args, model, rendered, span, timeout=None):
+        """一次非流式请求；timeout 为 None 时沿用客户端自身的超时与重试设置。"""
+        with self._slot(rendered, span):
+            raw_response = self._client_for(timeout).chat.completions.with_raw_response.create(
+                **{**completion_args, "model": model})
+            completion = raw_response.parse()
+        span.retries += raw_response.retries_taken
+        return completion
+
+    def _stream(self, agent, completion_args, rendered, system_role, response_format, cache_key, raise_errors,
+                on_error, span, owned):
+        parts = []
+        emitted = False
+        usage = None
+        finish_reason = None
+        policy = self.resilience
+        deadline_at = time.monotonic() + policy.deadline(agent) if policy else None
+        routed_model = completion_args["model"]
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                model = policy.choose_model(routed_model) if policy else routed_model
+                span.model = model
+                try:
+                    timeout = None
+                    if deadline_at is not None:
+                        timeout = deadline_at - time.monotonic()
+                        if timeout <= 0:
+                            raise DeadlineExceeded(f"{agent} 调用超过 {policy.deadline(agent)}s 时限")
+                    with self._slot(rendered, span):
+                        raw_response = self._client_for(timeout).chat.completions.with_raw_response.create(
+                            stream=True, stream_options={"include_usage": True}, **{**completion_args, "model": model})
+                        span.retries += raw_response.retries_taken
+                        for chunk in raw_response.parse():
+                            # include_usage 时最后一块只有 usage、没有 choices
+                            if chunk.usage is not None:
+                                usage = chunk.usage
+                            if not chunk.choices:
+                                continue
+                            finish_reason = chunk.choices[0].finish_reason or finish_reason
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                if not emitted:
+                                    span.mark_first_token()
+                                emitted = True
+                                parts.append(delta)
+                                yield delta
+                            if deadline_at is not None and time.monotonic() > deadline_at:
+                                raise DeadlineExceeded(f"{agent} 调用超过 {policy.deadline(agent)}s 时限")
+                except Exception as e:
+                    if policy is None:
+                        raise
+                    policy.record(model, e)
+                    # 已经输出过内容的流不能重试，否则页面上会出现重复文本
+                    delay = None if emitted else policy.next_delay(attempt, e, deadline_at)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    span.retries += 1
+                    continue
+                except BaseException:
+                    # 流被关闭 (Streamlit rerun 时的 GeneratorExit) 也要撤销半开试探
+                    if policy:
+                        policy.release(model)
+                    raise
+                if policy:
+                    policy.record(model)
+                break
+            span.set_usage(usage, rendered.tokens, estimate_tokens("".join(parts)))
+            # 只缓存完整接收、且没有因达到 max_tokens 被截断的输出
+            if cache_key and parts and finish_reason != "length":
+                self.cache.set(cache_key, "".join(parts))
+        except Exception as e:
+            span.error = repr(e)
+            if raise_errors:
+                raise
+            on_error(f"调用 GPT 时出错: {e}")
+            # 已经输出过部分内容时不再拼接错误文本，交给调用方的解析兜底
+            if not emitted:
+                yield error_fallback(e, system_role, response_format)
+        finally:
+            self._observe(agent, span, started)
+            if owned:
+                self.tracer.emit(span)
@@ -0,0 +1,447 @@
+"""Agent 输出解析：Trigger/Devil 的 `Key: value` 文本、Guide/Strategist 的 JSON、合并调用模式的 JSON，以及流式增量解析。
+
+JSON 输出按各 Agent 的 OutputSchema 校验：先在本地修复常见的格式问题 (代码块标记、前后多余文字、
+截断导致的括号不配平、多余逗号、键名写法与 is_end 的取值)，仍缺少的必填字段由调用方只针对这些字段补问一次
+(见 mind_engine)，最后才使用占位内容。
+"""
+import json
+import re
+from functools import lru_cache
+
+GUIDE_FALLBACK_SUGGESTIONS = ["建议生成失败"]
+GUIDE_FALLBACK_MEMORY = "记忆总结失败"
+SCENE_FALLBACK = "场景生成失败"
+THOUGHTS_FALLBACK = "想法生成失败"
+PROGRESSION_KEYS = ("next_scene_directive", "next_thought_directive", "is_end")
+# Strategist 输出无法使用时的默认规划
+DEFAULT_PROGRESSION = {
+    "next_scene_directive": "保持当前场景状态，围绕主题展开",
+    "next_thought_directive": "想法没有明显变化",
+    "is_end": "No"
+}
+
+
+@lru_cache(maxsize=16)
+def _key_patterns(key):
+    """`Key: value` 的预编译模式：行首严格匹配、任意位置匹配。容许 Markdown 加粗与全角冒号。"""
+    label = rf"[*#>\s-]*{re.escape(key)}[*\s]*[:：][*\s]*"
+    return (re.compile(rf"^{label}(.*)", re.MULTILINE | re.IGNORECASE),
+            re.compile(rf"{label}(.*)", re.DOTALL | re.IGNORECASE))
+
+
+_COT_LINE = re.compile(r"^\s*(思考过程|思考|分析)\s*[:：]", re.IGNORECASE)
+_NEXT_KEY_LINE = re.compile(r"^[*#>\s-]*[A-Za-z]+[*\s]*[:：]", re.MULTILINE)
+
+
+# 解析函数 (Trigger CoT, Devil)
+def parse_output(text, key):
+    if not isinstance(text, str):
+        return "解析错误：输入非字符串"
+    line_pattern, general_pattern = _key_patterns(key)
+
+    match = line_pattern.search(text)
+    if match:
+        return match.group(1).strip()
+    if key == "Scene":
+        # `Scene:` 不在行首 (例如紧跟在思考过程之后) 时取其后的全部内容
+        match = general_pattern.search(text)
+        return match.group(1).strip() if match else text
+
+    # Thoughts 缺少 `Key:` 时取最后一个非思考过程的非空行
+    if key == "Thoughts":
+        lines = [line.strip() for line in text.split('\n') if line.strip() and not _COT_LINE.match(line)]
+        return lines[-1] if lines else text
+
+    return text # Default return if no parsing matches
+
+
+def has_field(text, key):
+    """text 中是否出现 `Key:`；不出现时 parse_output 走的是兜底分支。"""
+    return isinstance(text, str) and _key_patterns(key)[1].search(text) is not None
+
+
+# --- JSON 输出的结构与本地修复 ---
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+# 截断处残留的半个键值对 (`, "key":`、`, "key"`)，只在对象内去掉；数组末尾完整的字符串元素要保留
+_DANGLING_KEY = re.compile(r'(,\s*"(?:[^"\\]|\\.)*"\s*:?\s*|"(?:[^"\\]|\\.)*"\s*:\s*)$')
+_DANGLING_COMMA = re.compile(r",\s*$")
+_CAMEL = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+# is_end 的取值按整词对照词表；出现任何否定或保留的说法即为 No，无法判断时视为无效，绝不推断为 Yes
+_YES = {"yes", "y", "true", "1", "是", "是的", "对", "对的", "结束", "可以结束", "应该结束", "应结束", "需要结束"}
+_NO = {"no", "n", "not", "false", "0"}
+_NO_MARKERS = ("不", "否", "未", "没", "尚早", "还", "暂", "继续")
+_TOKEN_SPLIT = re.compile(r"[\s,，。.!！;；、:：()（）]+")
+_LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.、)）])\s*")
+
+
+def _scan(text, start):
+    """从 text[start] 的 "{" 起扫描，返回 (配对的结束位置或 None, 未闭合的括号栈, 是否停在字符串内)。"""
+    stack, in_string, escape = [], False, False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            stack.append(c)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return i, stack, False
+    return None, stack, in_string
+
+
+def repair_json(raw):
+    """尽量把模型输出还原为 JSON 对象，返回 (对象或 None, 用到的修复列表)。合法 JSON 直接返回，不做修复。"""
+    if not isinstance(raw, str):
+        return None, []
+    try:
+        return json.loads(raw), []
+    except json.JSONDecodeError:
+        pass
+    repairs = []
+    text = _FENCE.sub("", raw.strip())
+    if text != raw.strip():
+        repairs.append("fence")
+    start = text.find("{")
+    if start < 0:
+        return None, repairs
+    if text[:start].strip():
+        repairs.append("leading_text")
+    end, stack, in_string = _scan(text, start)
+    if end is not None:
+        body = text[start:end + 1]
+        if text[end + 1:].strip():
+            repairs.append("trailing_text")
+    else:
+        # 输出被截断：闭合未完成的字符串，去掉半个键值对，再补齐括号
+        body = (text[start:] + ('"' if in_string else "")).rstrip()
+        if stack and stack[-1] == "{":
+            body = _DANGLING_KEY.sub("", body)
+        body = _DANGLING_COMMA.sub("", body)
+        body += "".join("}" if c == "{" else "]" for c in reversed(stack))
+        repairs.append("braces")
+    cleaned = _TRAILING_COMMA.sub(r"\1", body)
+    if cleaned != body:
+        repairs.append("trailing_comma")
+    try:
+        return json.loads(cleaned), repairs
+    except json.JSONDecodeError:
+        return None, repairs
+
+
+def canonical_key(key):
+    """"memorySummaryCurr" / "Memory-Summary" / " is end " -> "memory_summary_curr" / "memory_summary" / "is_end"。"""
+    return re.sub(r"[\s\-]+", "_", _CAMEL.sub("_", str(key).strip())).lower()
+
+
+class Field:
+    """kind: text (非空字符串) / list (非空字符串列表) / yesno ("Yes" 或 "No")。"""
+    __slots__ = ("name", "kind", "aliases", "required", "default", "hint")
+
+    def __init__(self, name, kind="text", aliases=(), required=True, default=None, hint=""):
+        self.name = name
+        self.kind = kind
+        self.aliases = (name, *aliases)
+        self.required = required
+        self.default = default # 缺失时在本地补上的值，不再补问
+        self.hint = hint
+
+    def coerce(self, value):
+        """返回 (规范化后的值或 None, 是否改动了取值)。"""
+        if self.kind == "list":
+            if isinstance(value, str):
+                items = [_LIST_ITEM.sub("", line).strip() for line in value.splitlines()]
+                items = [item for item in items if item]
+                return items or None, True
+            if isinstance(value, (list, tuple)):
+                items = [str(item).strip() for item in value if item is not None and str(item).strip()]
+                return items or None, len(items) != len(value) or not all(isinstance(item, str) for item in value)
+            return None, False
+        if self.kind == "yesno":
+            if isinstance(value, bool):
+                return ("Yes" if value else "No"), True
+            # "Yes." / "Yes, 可以结束" / "是的" 为 Yes："暂时不" / "结束为时尚早" / "No, 继续" 为 No；
+            # 其余 (例如带理由的长句) 视为无效，交给补问
+            text = str(value).strip().strip("\"'“”*").lower()
+            words = [word for word in _TOKEN_SPLIT.split(text) if word]
+            if not words:
+                return None, False
+            if any(word in _NO for word in words) or any(marker in text for marker in _NO_MARKERS):
+                return "No", value != "No"
+            if all(word in _YES for word in words):
+                return "Yes", value != "Yes"
+            return None, False
+        if isinstance(value, (list, tuple)):
+            value = "；".join(str(item) for item in value if item)
+            return value.strip() or None, True
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value), True
+        if isinstance(value, str):
+            return value.strip() or None, False
+        return None, False
+
+    def skeleton(self):
+        return [self.hint or "<...>"] if self.kind == "list" else (self.hint or "<...>")
+
+
+class ParsedOutput:
+    """schema 解析结果：values 为各字段的规范化取值，missing 为仍缺少的必填字段，repairs 为用到的本地修复。"""
+    __slots__ = ("values", "missing", "repairs", "error")
+
+    def __init__(self, values, missing=(), repairs=(), error=None):
+        self.values = values
+        self.missing = tuple(missing)
+        self.repairs = tuple(repairs)
+        self.error = error
+
+    @property
+    def ok(self):
+        return not self.missing
+
+    def merge(self, other):
+        """用补问得到的 other 填补本结果缺少的字段。"""
+        values = {**self.values, **{k: v for k, v in other.values.items() if k in self.missing}}
+        missing = [name for name in self.missing if name not in values]
+        repairs = list(dict.fromkeys(self.repairs + other.repairs))
+        return ParsedOutput(values, missing, repairs, f"缺少字段: {', '.join(missing)}" if missing else None)
+
+
+class OutputSchema:
+    """一个 Agent 的 JSON 输出结构。嵌套一层的对象 (例如 progression_directives) 会被展开后再按字段查找。"""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self._lookup = {canonical_key(alias): field for field in self.fields for alias in field.aliases}
+
+    def __add__(self, other):
+        return OutputSchema(f"{self.name}-{other.name}", self.fields + other.fields)
+
+    def field(self, name):
+        return next(field for field in self.fields if field.name == name)
+
+    def parse(self, raw):
+        data, repairs = repair_json(raw)
+        error = None
+        if not isinstance(data, dict):
+            data, error = {}, f"{self.name} 输出不是 JSON 对象"
+        repairs = list(repairs)
+        items = []
+        for key, value in data.items():
+            if isinstance(value, dict) and canonical_key(key) not in self._lookup:
+                items.extend(value.items())
+            else:
+                items.append((key, value))
+        values, invalid = {}, set()
+        for key, value in items:
+            field = self._lookup.get(canonical_key(key))
+            if field is None or field.name in values:
+                continue
+            coerced, changed = field.coerce(value)
+            if coerced is None:
+                invalid.add(field.name)
+                continue
+            if key != field.name and "keys" not in repairs:
+                repairs.append("keys")
+            if changed and "values" not in repairs:
+                repairs.append("values")
+            values[field.name] = coerced
+        missing = []
+        for field in self.fields:
+            if field.name in values:
+                continue
+            # 给出了但无法识别的取值不套用默认值 (例如 is_end 的意图不明时不能默认为 No)
+            if field.default is not None and field.name not in invalid:
+                values[field.name] = field.default
+                repairs.append(f"default:{field.name}")
+            elif field.required:
+                missing.append(field.name)
+        if missing and error is None:
+            error = f"缺少字段: {', '.join(missing)}"
+        return ParsedOutput(values, missing, repairs, error)
+
+    def skeleton(self, names):
+        """只含 names 这些字段的 JSON 输出格式说明，用于定向补问。"""
+        return json.dumps({name: self.field(name).skeleton() for name in names}, ensure_ascii=False, indent=2)
+
+
+GUIDE_SCHEMA = OutputSchema("guide", (
+    Field("guidance_suggestions", "list", ("guide_suggestions", "suggestions", "guidance"), hint="<建议>"),
+    Field("memory_summary_curr", "text", ("memory_summary", "memory", "summary"), hint="<本回合的结构化记忆总结 Mᵢ，简明扼要>"),
+))
+STRATEGIST_SCHEMA = OutputSchema("strategist", (
+    Field("next_scene_directive", "text", ("scene_directive", "next_scene"), hint="<对下一场景 (Sᵢ₊₁) 的构建或调整的具体指导>"),
+    Field("next_thought_directive", "text", ("thought_directive", "next_thought"), hint="<对下一轮想法 (Dᵢ₊₁) 演变方向的具体指导>"),
+    # is_end 缺失时按“不结束”处理，与提示词中“判断要保守”一致
+    Field("is_end", "yesno", ("end", "should_end", "finished"), default="No", hint="<Yes/No>"),
+))
+SCENE_THOUGHT_SCHEMA = OutputSchema("scene-thought", (
+    Field("scene", "text", ("scenario", "s"), hint="<当前场景，不超过150字>"),
+    Field("thoughts", "text", ("thought", "devil_thoughts", "d"), hint="<第一人称的想法，不超过30字>"),
+    Field("type", "text", ("devil_type", "distortion_type", "distortion"), required=False),
+))
+GUIDE_STRATEGIST_SCHEMA = GUIDE_SCHEMA + STRATEGIST_SCHEMA
+SCHEMAS = {
+    "guide": GUIDE_SCHEMA,
+    "strategist": STRATEGIST_SCHEMA,
+    "scene-thought": SCENE_THOUGHT_SCHEMA,
+    "guide-strategist": GUIDE_STRATEGIST_SCHEMA,
+}
+
+
+def guide_fields(parsed, raw=None):
+    """返回 (guide_suggestions, memory_summary, error)；缺失的字段使用占位内容。"""
+    values = parsed.values
+    error = f"Guide 输出处理错误: {parsed.error}. Raw: {raw}" if parsed.missing else None
+    return (list(values.get("guidance_suggestions") or GUIDE_FALLBACK_SUGGESTIONS),
+            values.get("memory_summary_curr", GUIDE_FALLBACK_MEMORY), error)
+
+
+def progression_fields(parsed, raw=None):
+    """返回 (progression_directives, error)；只有缺失的指令退回默认规划。"""
+    progression_directives = {key: parsed.values.get(key, DEFAULT_PROGRESSION[key]) for key in PROGRESSION_KEYS}
+    missing = [key for key in parsed.missing if key in PROGRESSION_KEYS]
+    error = f"Strategist 输出处理错误: 缺少 {', '.join(missing)}，使用默认规划。Raw: {raw}" if missing else None
+    return progression_directives, error
+
+
+def scene_thought_fields(parsed, raw=None):
+    """返回 (scene, thoughts, type, error)。JSON 无法使用时退回按 `Scene:` / `Thoughts:` 文本解析，都没有时使用占位内容。"""
+    values = parsed.values
+    if parsed.ok:
+        return values["scene"], values["thoughts"], values.get("type"), None
+    error = f"场景与想法输出处理错误: {parsed.error}. Raw: {raw}"
+    if isinstance(raw, str) and not values and has_field(raw, "Scene") and has_field(raw, "Thoughts"):
+        llm_type = parse_output(raw, "Type") if has_field(raw, "Type") else None
+        return parse_output(raw, "Scene"), parse_output(raw, "Thoughts"), llm_type, error
+    return values.get("scene", SCENE_FALLBACK), values.get("thoughts", THOUGHTS_FALLBACK), values.get("type"), error
+
+
+_JSON_STRING_FIELD = {}
+
+
+def partial_json_field(text, key):
+    """从尚未完成的 JSON 文本中取出字符串字段 key 当前已到达的部分。"""
+    pattern = _JSON_STRING_FIELD.get(key)
+    if pattern is None:
+        pattern = _JSON_STRING_FIELD[key] = re.compile(rf'"{re.escape(key)}"\s*:\s*"((?:[^"\\]|\\.)*)')
+    match = pattern.search(text)
+    if not match:
+        return ""
+    value = match.group(1)
+    if value.endswith("\\") and not value.endswith("\\\\"):
+        value = value[:-1]
+    try:
+        return json.loads(f'"{value}"')
+    except json.JSONDecodeError:
+        return value
+
+
+def partial_field(text, key):
+    """从尚未完成的 `Key: value` 文本中取出 key 当前已到达的部分；键的写法与 parse_output 一致 (加粗、全角冒号)。"""
+    match = _key_patterns(key)[0].search(text)
+    if not match:
+        return ""
+    value = text[match.start(1):]
+    # 遇到下一个 `Key:` 行即截断 (例如 Devil 输出中 Type 之后的 Thoughts)
+    next_key = _NEXT_KEY_LINE.search(value)
+    if next_key and next_key.start() > 0:
+        value = value[:next_key.start()]
+    return value.strip()
+
+
+def stream_text(chunks, key, render):
+    """消费流式输出，边接收边把 key 字段的部分内容交给 render 显示，返回完整文本。"""
+    if isinstance(chunks, str):
+        render(partial_field(chunks, key))
+        return chunks
+    text = ""
+    for delta in chunks:
+        text += delta
+        value = partial_field(text, key)
+        if value:
+            render(value)
+    return text
+
+
+class IncrementalJSONArray:
+    """增量解析 JSON 流，逐条取出指定 key 下数组中已完整到达的字符串元素。"""
+
+    def __init__(self, key):
+        self.key = key
+        self.items = []
+        self._buf = ""
+        self._pos = 0
+        self._stack = [] # 每层为 (容器类型, 该容器在父对象中的 key)
+        self._in_string = False
+        self._escape = False
+        self._str_start = 0
+        self._pending_key = None
+        self._current_key = None
+
+    def _in_target(self):
+        return bool(self._stack) and self._stack[-1] == ("[", self.key)
+
+    def feed(self, chunk):
+        """送入一段新文本，返回本次新完成的数组元素。"""
+        self._buf += chunk
+        new_items = []
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    try:
+                        value = json.loads(buf[self._str_start:i + 1])
+                    except json.JSONDecodeError:
+                        value = buf[self._str_start + 1:i]
+                    if self._in_target():
+                        self.items.append(value)
+                        new_items.append(value)
+                    elif self._stack and self._stack[-1][0] == "{" and self._current_key is None:
+                        self._pending_key = value
+            elif c == '"':
+                self._in_string = True
+                self._str_start = i
+            elif c == ":":
+                self._current_key = self._pending_key
+            elif c in "{[":
+                parent_key = self._current_key if self._stack and self._stack[-1][0] == "{" else None
+                self._stack.append((c, parent_key))
+                self._current_key = None
+                self._pending_key = None
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+                self._current_key = None
+            elif c == ",":
+                self._current_key = None
+                self._pending_key = None
+        self._pos = len(buf)
+        return new_items
+
+    def partial(self):
+        """目标数组中正在生成、尚未闭合的元素文本。"""
+        if not (self._in_string and self._in_target()):
+            return ""
+        raw = self._buf[self._str_start + 1:]
+        if raw.endswith("\\"):
+            raw = raw[:-1]
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return raw
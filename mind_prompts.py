@@ -0,0 +1,356 @@
+"""提示词模板：导入时一次性编译为渲染函数，带缺失变量检查、token 估算与按 Agent 的输入预算。
+
+模板统一把固定的角色说明、要求和输出格式放在前面，变量内容集中放在末尾的“输入”段，
+这样同一 Agent 的各次请求共享尽可能长的静态前缀，便于服务端的前缀缓存命中。
+LLM.call 对登记在 PROMPTS 中的模板严格渲染 (缺少变量即抛出 MissingVariableError)，裁剪过的变量记录在 span 中。
+"""
+import math
+import re
+from functools import lru_cache
+
+MISSING_VALUE = "信息缺失"
+_FIELD_PATTERN = re.compile(r"\{([a-zA-Z0-9_]+)\}")
+
+PROMPT_TEMPLATES = {
+    # Trigger (τ) - Round 0
+    "trigger_0": """
+你是一个情景再现师 (Trigger, τ)。
+任务：根据下方给出的主题 (T) 和用户的初始担忧 (W)，生成初始场景 (S₀)。
+要求：
+1. 场景应充分反映用户的状态、担忧和所选主题。
+2. 场景是故事背景，不含对话或心理描述。
+3. 不含价值判断。
+4. 参考案例来自 C2D2 数据集的相似真实场景，仅供参考风格与细节，不要照抄。
+5. 输出格式：
+Scene: <生成的初始场景 S₀，不超过150字>
+
+--- 输入 ---
+主题 (T): {theme}
+用户的初始担忧 (W): {concerns}
+参考案例：
+{c2d2_examples}
+""",
+    # Trigger (τ) - 接收 Pᵢ₋₁ 中的场景指导
+    "trigger_i": """
+你是一个情景再现师 (Trigger, τ)。
+任务：基于主题、上一轮 (i-1) 用户的安慰 (Cᵢ₋₁) 以及上一轮策略师对本轮场景的指导 (来自 Pᵢ₋₁)，生成当前轮 (i) 的场景 (Sᵢ)。
+要求：
+1. 首先，请思考场景如何根据策略师的指导和对话主题进行构建或调整，说明思考过程 (CoT)。
+2. 然后，输出生成的场景 Sᵢ。
+3. 场景要与历史发展、对话主题和策略师指导一致。
+4. 场景是故事背景，不含对话或心理描述。
+5. 不含价值判断。
+6. 输出格式：
+思考过程：<你的思考>
+Scene: <生成的场景 Sᵢ，不超过150字>
+
+--- 输入 ---
+主题 (T): {theme}
+上一轮策略师对本轮场景的指导: {directive_scene}
+上一轮用户的安慰 (Cᵢ₋₁): {comfort_prev}
+""",
+    # Devil (δ) - Round 0；类型由本地分类器标注 (MIND_DEVIL_TYPE=local)，不再向 LLM 索要 Type
+    "devil_0": """
+你是一个模拟认知扭曲的患者 (Devil, δ)。
+任务：基于下方的初始场景 (S₀) 和担忧 (W)，模拟第一人称视角，产生一个核心的初始负面想法 (D₀)。
+要求：
+1. 想法要符合场景、担忧和人格特质。
+2. 简短，像内心闪过的念头。
+3. 示例来自 C2D2 数据集中相似场景下的真实想法，仅供参考。
+4. 输出格式：
+Thoughts: <第一人称的初始想法 D₀，不超过30字>
+
+--- 输入 ---
+你的人格特质倾向: {personality_traits}
+初始场景 (S₀): {scene}
+你的初始担忧 (W): {concerns}
+示例：
+{c2d2_examples}
+""",
+    # Devil (δ) - Round 0，由 LLM 同时给出类型 (MIND_DEVIL_TYPE=llm)
+    "devil_0_typed": """
+你是一个模拟认知扭曲的患者 (Devil, δ)。
+任务：基于下方的初始场景 (S₀) 和担忧 (W)，模拟第一人称视角，产生一个核心的初始负面想法 (D₀)，并说明其认知扭曲类型。
+要求：
+1. 想法要符合场景、担忧和人格特质。
+2. 简短，像内心闪过的念头。
+3. 示例来自 C2D2 数据集中相似场景下的真实想法，仅供参考。
+4. 输出格式：
+Type: <认知扭曲类型>
+Thoughts: <第一人称的初始想法 D₀，不超过30字>
+
+--- 输入 ---
+你的人格特质倾向: {personality_traits}
+初始场景 (S₀): {scene}
+你的初始担忧 (W): {concerns}
+示例：
+{c2d2_examples}
+""",
+    # Devil (δ) - Round i>0
+    "devil_i": """
+你是一个模拟认知扭曲的患者 (Devil, δ)。
+任务：根据当前情境、人格特质、上一轮互动以及策略师的指导，模拟你此刻第一人称可能的想法 (Dᵢ)。这个想法应体现出策略师指导的思想演变方向（或固守）。
+要求：
+1. 想法要符合情境、人格、互动历史和指导方向。
+2. 简短，像内心闪过的念头。
+3. 输出格式：
+Thoughts: <第一人称的想法 Dᵢ，不超过30字>
+
+--- 输入 ---
+你的人格特质倾向: {personality_traits}
+你的认知扭曲类型大致是: {type_prev}
+上一轮策略师对你本轮思想演变的指导 (来自 Pᵢ₋₁): {directive_thought}
+当前场景 (Sᵢ): {scene}
+上一轮 (i-1) 你的想法 (Dᵢ₋₁): {thought_prev}
+上一轮 (i-1) 安慰者的话 (Cᵢ₋₁): {comfort_prev}
+""",
+    # Guide (g) - 输出 Gᵢ 和 Mᵢ
+    "guide": """
+你是一个专业的心理指导师 (Guide, g)。
+任务：
+1. 生成1-2条具体的、可操作的安慰引导建议 (Gᵢ)，帮助“安慰者”进行认知重构。
+2. 基于当前场景 (Sᵢ) 和想法 (Dᵢ)，生成本回合的结构化记忆总结 (Mᵢ)。总结应包含场景关键点、想法核心、认知扭曲类型、潜在的情感基调。
+要求：
+1. 建议 (Gᵢ) 要紧密结合 Sᵢ 和 Dᵢ。
+2. 记忆总结 (Mᵢ) 要简洁、结构化，捕捉本轮核心信息。
+3. 输出必须是严格的 JSON 格式：
+{
+  "guidance_suggestions": [
+    "<建议1>",
+    "<建议2>"
+  ],
+  "memory_summary_curr": "<本回合的结构化记忆总结 Mᵢ，简明扼要>"
+}
+
+--- 输入 ---
+当前场景 (Sᵢ): {scene}
+患者当前的想法 (Dᵢ): {thoughts} (类型: {type})
+""",
+    # Strategist (ς) - 接收 Mᵢ 和 Cᵢ, 输出 Pᵢ
+    "strategist": """
+你是一个故事策划和情节控制师 (Strategist, ς)。
+任务：基于本回合 (i) Guide 生成的结构化记忆总结 (Mᵢ) 和用户的安慰话语 (Cᵢ)，生成下一回合 (i+1) 的规划 (Pᵢ)。规划应包含对下一场景和下一轮 Devil 思想演变的指导，以及是否结束对话的判断。
+要求：
+1. 规划要基于 Mᵢ 和 Cᵢ 进行推理，体现逻辑连续性。思想变化通常是缓慢的。
+2. 指令需要清晰，能被下一轮的 Trigger 和 Devil 理解。
+3. `is_end` 的判断要保守，仅当 Mᵢ 显示认知扭曲基本消除且 Cᵢ 反映出稳定状态时才为 Yes。
+4. 输出必须是严格的 JSON 格式：
+{
+  "progression_directives": {
+    "next_scene_directive": "<对下一场景 (Sᵢ₊₁) 的构建或调整的具体指导>",
+    "next_thought_directive": "<对下一轮想法 (Dᵢ₊₁) 演变方向的具体指导，例如：维持扭曲/尝试反思/表达困惑/略微认同安慰等>",
+    "is_end": "<判断对话是否可以结束 (Yes/No)>"
+  }
+}
+
+--- 输入 ---
+本回合 (i) 的结构化记忆总结 (Mᵢ)：{memory_summary_curr}
+本回合 (i) 用户的安慰话语 (Cᵢ)：{comfort_curr}
+对话进展检测 (本地统计，供判断 is_end 参考)：{convergence_note}
+""",
+    # --- 合并调用模式 (MIND_PIPELINE=fused)：一次请求同时完成 Trigger+Devil 或 Guide+Strategist ---
+    # Trigger (τ) + Devil (δ) - Round 0
+    "scene-thought_0": """
+你同时扮演两个角色：情景再现师 (Trigger, τ) 与模拟认知扭曲的患者 (Devil, δ)。
+任务：
+1. 作为 Trigger，根据主题 (T) 和用户的初始担忧 (W) 生成初始场景 (S₀)。场景是故事背景，不含对话或心理描述，不含价值判断，充分反映用户的状态、担忧和主题。
+2. 作为 Devil，基于 S₀、W 和人格特质，以第一人称产生一个核心的初始负面想法 (D₀)，简短，像内心闪过的念头，并说明其认知扭曲类型。
+3. 参考案例来自 C2D2 数据集中相似的真实场景与想法，仅供参考风格与细节，不要照抄。
+输出必须是严格的 JSON 格式：
+{
+  "scene": "<初始场景 S₀，不超过150字>",
+  "thoughts": "<第一人称的初始想法 D₀，不超过30字>",
+  "type": "<认知扭曲类型>"
+}
+
+--- 输入 ---
+主题 (T): {theme}
+用户的初始担忧 (W): {concerns}
+人格特质倾向: {personality_traits}
+参考案例：
+{c2d2_examples}
+""",
+    # Trigger (τ) + Devil (δ) - Round i>0
+    "scene-thought_i": """
+你同时扮演两个角色：情景再现师 (Trigger, τ) 与模拟认知扭曲的患者 (Devil, δ)。
+任务：
+1. 作为 Trigger，基于主题、上一轮用户的安慰 (Cᵢ₋₁) 和策略师对本轮场景的指导 (来自 Pᵢ₋₁) 生成当前场景 (Sᵢ)。场景要与历史发展、主题和指导一致，是故事背景，不含对话或心理描述，不含价值判断。
+2. 作为 Devil，根据 Sᵢ、人格特质、上一轮互动和策略师对思想演变的指导，以第一人称产生此刻的想法 (Dᵢ)，体现指导的演变方向（或固守），简短，像内心闪过的念头，并说明其认知扭曲类型。
+输出必须是严格的 JSON 格式：
+{
+  "scene": "<当前场景 Sᵢ，不超过150字>",
+  "thoughts": "<第一人称的想法 Dᵢ，不超过30字>",
+  "type": "<认知扭曲类型>"
+}
+
+--- 输入 ---
+主题 (T): {theme}
+上一轮策略师对本轮场景的指导: {directive_scene}
+上一轮策略师对本轮思想演变的指导: {directive_thought}
+人格特质倾向: {personality_traits}
+上一轮的认知扭曲类型: {type_prev}
+上一轮 (i-1) 的想法 (Dᵢ₋₁): {thought_prev}
+上一轮 (i-1) 安慰者的话 (Cᵢ₋₁): {comfort_prev}
+""",
+    # Guide (g) + Strategist (ς) - 输出 Gᵢ、Mᵢ 与 Pᵢ
+    "guide-strategist": """
+你同时扮演两个角色：心理指导师 (Guide, g) 与故事策划和情节控制师 (Strategist, ς)。
+任务：
+1. 作为 Guide，生成1-2条紧密结合 Sᵢ 和 Dᵢ 的具体、可操作的安慰引导建议 (Gᵢ)，帮助“安慰者”进行认知重构；并生成本回合简洁、结构化的记忆总结 (Mᵢ)，包含场景关键点、想法核心、认知扭曲类型、潜在的情感基调。
+2. 作为 Strategist，基于 Mᵢ 和用户的安慰话语 (Cᵢ) 生成下一回合的规划 (Pᵢ)：对下一场景和下一轮思想演变的清晰指导，体现逻辑连续性 (思想变化通常是缓慢的)；`is_end` 的判断要保守，仅当认知扭曲基本消除且 Cᵢ 反映出稳定状态时才为 Yes。
+输出必须是严格的 JSON 格式：
+{
+  "guidance_suggestions": [
+    "<建议1>",
+    "<建议2>"
+  ],
+  "memory_summary_curr": "<本回合的结构化记忆总结 Mᵢ，简明扼要>",
+  "progression_directives": {
+    "next_scene_directive": "<对下一场景 (Sᵢ₊₁) 的构建或调整的具体指导>",
+    "next_thought_directive": "<对下一轮想法 (Dᵢ₊₁) 演变方向的具体指导>",
+    "is_end": "<判断对话是否可以结束 (Yes/No)>"
+  }
+}
+
+--- 输入 ---
+当前场景 (Sᵢ): {scene}
+患者当前的想法 (Dᵢ): {thoughts} (类型: {type})
+本回合 (i) 用户的安慰话语 (Cᵢ): {comfort_curr}
+对话进展检测 (本地统计，供判断 is_end 参考): {convergence_note}
+""",
+}
+
+# JSON 输出在本地修复后仍缺少必填字段时的定向补问：只索要缺失的字段。
+# 模板 id 为 "<agent>_repair"，与原 Agent 共用路由、输入预算与调用统计
+REPAIR_TEMPLATE = """
+你之前为下面的任务给出的输出缺少以下字段：{missing_fields}。
+请只补全这些字段，不要重复其他内容。
+输出必须是严格的 JSON 格式：
+{field_format}
+
+--- 原任务 ---
+{task}
+
+--- 你之前的输出 ---
+{previous_output}
+"""
+PROMPT_TEMPLATES.update({f"{agent}_repair": REPAIR_TEMPLATE for agent in ("guide", "strategist", "scene-thought", "guide-strategist")})
+
+# 每个 Agent 用户消息的输入 token 预算 (估算值)
+INPUT_TOKEN_BUDGETS = {
+    "trigger": 900,
+    "devil": 700,
+    "guide": 700,
+    "strategist": 900,
+    "scene-thought": 1400,
+    "guide-strategist": 1200,
+}
+# 超出预算时可裁剪的长字段；裁剪时先处理当前最长的字段
+TRIMMABLE_FIELDS = ("c2d2_examples", "comfort_prev", "comfort_curr", "memory_summary_curr", "concerns", "previous_output")
+MIN_FIELD_CHARS = 40
+_TRIM_MARKER = "…(略)…"
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文等非 ASCII 字符约 1 token/字，ASCII 约 4 字符/token。"""
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return non_ascii + math.ceil((len(text) - non_ascii) / 4)
+
+
+def trim_middle(text, max_chars):
+    """保留开头和结尾，截去中间部分。"""
+    if len(text) <= max_chars:
+        return text
+    keep = max(max_chars - len(_TRIM_MARKER), 2)
+    head = keep * 2 // 3
+    return text[:head] + _TRIM_MARKER + text[len(text) - (keep - head):]
+
+
+def template_agent(template_id):
+    # "trigger_0" / "trigger_i" -> "trigger"，"scene-thought_0" -> "scene-thought"
+    return template_id.split("_")[0] if template_id else None
+
+
+class MissingVariableError(KeyError):
+    pass
+
+
+class RenderedPrompt:
+    __slots__ = ("template_id", "text", "tokens", "missing", "trimmed")
+
+    def __init__(self, template_id, text, tokens, missing, trimmed):
+        self.template_id = template_id
+        self.text = text
+        self.tokens = tokens
+        self.missing = missing
+        self.trimmed = trimmed
+
+    def __str__(self):
+        return self.text
+
+
+class PromptTemplate:
+    def __init__(self, template_id, text, budget=None):
+        parts = _FIELD_PATTERN.split(text)
+        self.template_id = template_id
+        self.text = text
+        self._literals = parts[0::2]
+        self._fields = parts[1::2]
+        self.variables = frozenset(self._fields)
+        self.budget = budget
+        self._static_tokens = estimate_tokens("".join(self._literals))
+
+    @property
+    def agent(self):
+        return template_agent(self.template_id)
+
+    def _join(self, values):
+        out = [self._literals[0]]
+        for field, literal in zip(self._fields, self._literals[1:]):
+            out.append(values[field])
+            out.append(literal)
+        return "".join(out)
+
+    def render(self, variables, strict=False):
+        """渲染模板，不修改调用方的 variables；缺失变量以 "信息缺失" 填充 (strict=True 时抛出异常)。"""
+        missing = sorted(self.variables - variables.keys())
+        if missing and strict:
+            raise MissingVariableError(f"{self.template_id} 缺少变量: {', '.join(missing)}")
+        values = {}
+        for field in self.variables:
+            value = variables.get(field, MISSING_VALUE)
+            values[field] = str(value) if value is not None else "无"
+
+        trimmed = []
+        if self.budget:
+            tokens = self._static_tokens + sum(estimate_tokens(values[f]) * self._fields.count(f) for f in self.variables)
+            candidates = [f for f in TRIMMABLE_FIELDS if f in values and len(values[f]) > MIN_FIELD_CHARS]
+            for field in sorted(candidates, key=lambda f: -len(values[f])):
+                if tokens <= self.budget:
+                    break
+                before = estimate_tokens(values[field])
+                # 按估算的每字符 token 数折算需要截去的字符数
+                ratio = before / len(values[field])
+                target = max(MIN_FIELD_CHARS, len(values[field]) - math.ceil((tokens - self.budget) / ratio))
+                values[field] = trim_middle(values[field], target)
+                tokens -= (before - estimate_tokens(values[field])) * self._fields.count(field)
+                trimmed.append(field)
+
+        text = self._join(values)
+        return RenderedPrompt(self.template_id, text, estimate_tokens(text), missing, trimmed)
+
+
+def compile_templates(templates, budgets=INPUT_TOKEN_BUDGETS):
+    return {
+        template_id: PromptTemplate(template_id, text, budgets.get(template_agent(template_id)))
+        for template_id, text in templates.items()
+    }
+
+
+PROMPTS = compile_templates(PROMPT_TEMPLATES)
+
+
+@lru_cache(maxsize=64)
+def compile_adhoc(text):
+    """为未登记的临时提示词编译模板 (无 template_id、无预算)。"""
+    return PromptTemplate(None, text)
@@ -0,0 +1,62 @@
+"""令牌桶限流：同时限制每分钟请求数 (RPM)、每分钟 token 数 (TPM) 与全局并发请求数。"""
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount=1):
+        """阻塞直到桶中有足够的令牌；超过桶容量的请求按容量计。"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """组合 RPM/TPM 令牌桶与并发上限，供 LLM 在每次请求前调用 `with limiter.request(tokens):`。"""
+
+    def __init__(self, rpm=None, tpm=None, max_inflight=None, completion_reserve=256):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self._inflight = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+        self.completion_reserve = completion_reserve
+        self._lock = threading.Lock()
+        self.granted_requests = 0
+        self.granted_tokens = 0
+
+    @contextmanager
+    def request(self, prompt_tokens):
+        # TPM 按估算的输入 token 加上预留的输出 token 计
+        tokens = prompt_tokens + self.completion_reserve
+        if self._inflight:
+            self._inflight.acquire()
+        try:
+            if self.requests:
+                self.requests.acquire(1)
+            if self.tokens:
+                self.tokens.acquire(tokens)
+            with self._lock:
+                self.granted_requests += 1
+                self.granted_tokens += tokens
+            yield
+        finally:
+            if self._inflight:
+                self._inflight.release()
@@ -0,0 +1,278 @@
+"""LLM 调用的容错策略：按 Agent 的总时限、429/5xx 的指数退避重试 (full jitter)、超过 p95 时的对冲请求，
+以及错误率过高时切换到备用模型的熔断器。
+
+环境变量:
+    MIND_DEADLINES="trigger=30,devil=30,guide=30,strategist=20"   每个 Agent 单次调用 (含重试) 的总时限，秒
+    MIND_MAX_ATTEMPTS=3   MIND_BACKOFF_BASE=0.5   MIND_BACKOFF_CAP=8
+    MIND_HEDGE=1 开启对冲   MIND_HEDGE_MAX_RATIO=0.1 对冲请求占比上限   MIND_HEDGE_MIN_DELAY=0.3
+    MIND_FALLBACK_MODEL=gpt-4o-mini (留空关闭熔断)   MIND_BREAKER_ERROR_RATE=0.5   MIND_BREAKER_COOLDOWN=30
+
+对冲只用于非流式调用 (ResiliencePolicy.execute)：Strategist、合并模式的 Guide+Strategist、后台预取的 Guide
+与缺失字段补问。界面默认流式输出的 Trigger、Devil 与同步等待的 Guide 走 LLM._stream，只有时限、重试与熔断，不对冲。
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+DEFAULT_DEADLINES = {"trigger": 30.0, "devil": 30.0, "guide": 30.0, "strategist": 20.0,
+                     "scene-thought": 45.0, "guide-strategist": 40.0}
+DEFAULT_DEADLINE = 30.0
+RETRYABLE_STATUS = (408, 409, 429)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def parse_deadlines(spec):
+    """解析 "trigger=20,guide=15" 形式的时限覆盖。"""
+    deadlines = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        agent, seconds = (part.strip() for part in item.split("=", 1))
+        deadlines[agent] = float(seconds)
+    return deadlines
+
+
+def is_retryable(error):
+    import openai # 只在出错时用到；不在模块顶层导入，以免拖慢界面首屏
+
+    if isinstance(error, (openai.APIConnectionError, DeadlineExceeded)): # 含 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def retry_after(error):
+    """429/503 响应中的 Retry-After (秒)，没有时返回 None。"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base=0.5, cap=8.0, rng=None):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt, error=None):
+        # full jitter: 在 [0, min(cap, base * 2^attempt)] 内均匀取值，避免大量会话同时重试
+        delay = self.rng.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        hinted = retry_after(error)
+        return max(delay, min(hinted, self.cap)) if hinted is not None else delay
+
+
+class CircuitBreaker:
+    """按模型统计最近 window 次调用；错误率超过 error_rate 时熔断 cooldown 秒，期间改用 fallback_model。
+    冷却结束后放行一次试探请求 (半开)，成功则恢复，失败则继续熔断。"""
+
+    def __init__(self, fallback_model, window=20, min_calls=5, error_rate=0.5, cooldown=30.0):
+        self.fallback_model = fallback_model
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes = {}
+        self._opened_at = {}
+        self._probing = set()
+
+    def choose(self, model):
+        if not self.fallback_model or model == self.fallback_model:
+            return model
+        with self._lock:
+            opened_at = self._opened_at.get(model)
+            if opened_at is None:
+                return model
+            if time.monotonic() - opened_at < self.cooldown or model in self._probing:
+                return self.fallback_model
+            self._probing.add(model)
+            return model
+
+    def record(self, model, ok):
+        with self._lock:
+            outcomes = self._outcomes.setdefault(model, deque(maxlen=self.window))
+            if model in self._probing:
+                self._probing.discard(model)
+                if ok:
+                    self._opened_at.pop(model, None)
+                    outcomes.clear()
+                else:
+                    self._opened_at[model] = time.monotonic()
+                return
+            outcomes.append(ok)
+            failures = outcomes.count(False)
+            if model not in self._opened_at and len(outcomes) >= self.min_calls and failures / len(outcomes) >= self.error_rate:
+                self._opened_at[model] = time.monotonic()
+
+    def release(self, model):
+        """试探请求没有给出模型是否恢复的信号 (非可重试错误、调用方中途放弃)：撤销试探，保持熔断，下次再试探。"""
+        with self._lock:
+            self._probing.discard(model)
+
+
+class HedgePolicy:
+    """首个请求超过该 Agent 近期 p95 仍未返回时发出一个重复请求，先返回者胜出；对冲请求数受 max_ratio 限制。"""
+
+    def __init__(self, max_ratio=0.1, min_delay=0.3, min_samples=20, window=200, max_workers=32):
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._p95 = {}
+        self.window = window
+        self.calls = 0
+        self.hedges = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mind-hedge")
+
+    def observe(self, agent, seconds):
+        with self._lock:
+            samples = self._latencies.setdefault(agent, deque(maxlen=self.window))
+            samples.append(seconds)
+            # 每 10 个样本重新计算一次 p95
+            if len(samples) >= self.min_samples and len(samples) % 10 == 0:
+                ordered = sorted(samples)
+                self._p95[agent] = ordered[int(0.95 * (len(ordered) - 1))]
+
+    def delay(self, agent):
+        p95 = self._p95.get(agent)
+        return None if p95 is None else max(self.min_delay, p95)
+
+    def _take_budget(self):
+        with self._lock:
+            if self.hedges + 1 > self.max_ratio * max(self.calls, 1):
+                return False
+            self.hedges += 1
+            return True
+
+    def run(self, agent, fn, timeout):
+        """执行 fn()，必要时对冲；返回 (结果, 是否发出了对冲请求)。"""
+        with self._lock:
+            self.calls += 1
+        delay = self.delay(agent)
+        if delay is None or delay >= timeout:
+            return fn(), False
+        first = self._executor.submit(fn)
+        done, _ = wait([first], timeout=delay)
+        if done or not self._take_budget():
+            return first.result(), False
+        pending = {first, self._executor.submit(fn)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    # 落后的请求继续在后台完成，其结果被丢弃
+                    return future.result(), True
+                except Exception as e:
+                    error = e
+        raise error
+
+
+class ResiliencePolicy:
+    def __init__(self, deadlines=None, retry=None, breaker=None, hedge=None):
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker
+        self.hedge = hedge
+
+    @classmethod
+    def from_env(cls):
+        retry = RetryPolicy(
+            max_attempts=int(os.getenv("MIND_MAX_ATTEMPTS", "3")),
+            base=float(os.getenv("MIND_BACKOFF_BASE", "0.5")),
+            cap=float(os.getenv("MIND_BACKOFF_CAP", "8")),
+        )
+        breaker = None
+        fallback_model = os.getenv("MIND_FALLBACK_MODEL", "gpt-4o-mini")
+        if fallback_model:
+            breaker = CircuitBreaker(
+                fallback_model,
+                error_rate=float(os.getenv("MIND_BREAKER_ERROR_RATE", "0.5")),
+                cooldown=float(os.getenv("MIND_BREAKER_COOLDOWN", "30")),
+            )
+        hedge = None
+        if os.getenv("MIND_HEDGE", "0") == "1":
+            hedge = HedgePolicy(
+                max_ratio=float(os.getenv("MIND_HEDGE_MAX_RATIO", "0.1")),
+                min_delay=float(os.getenv("MIND_HEDGE_MIN_DELAY", "0.3")),
+            )
+        return cls(parse_deadlines(os.getenv("MIND_DEADLINES", "")), retry, breaker, hedge)
+
+    def deadline(self, agent):
+        return self.deadlines.get(agent, DEFAULT_DEADLINE)
+
+    def choose_model(self, model):
+        return self.breaker.choose(model) if self.breaker else model
+
+    def record(self, model, error=None):
+        # 只有可重试的错误 (限流、服务端错误、超时) 计入熔断，请求本身有误的 4xx 不算，但要撤销半开试探
+        if self.breaker is None:
+            return
+        if error is None or is_retryable(error):
+            self.breaker.record(model, error is None)
+        else:
+            self.breaker.release(model)
+
+    def release(self, model):
+        # 调用被中途放弃 (GeneratorExit、KeyboardInterrupt 等) 时撤销可能存在的半开试探
+        if self.breaker is not None:
+            self.breaker.release(model)
+
+    def next_delay(self, attempt, error, deadline_at):
+        """第 attempt 次尝试失败后的等待秒数；不应重试时返回 None。"""
+        if not is_retryable(error) or attempt + 1 >= self.retry.max_attempts:
+            return None
+        delay = self.retry.delay(attempt, error)
+        if time.monotonic() + delay >= deadline_at:
+            return None
+        return delay
+
+    def execute(self, agent, model, attempt_fn, span=None):
+        """非流式调用：attempt_fn(model, timeout) 执行一次请求。负责熔断选模、时限、重试与对冲。"""
+        deadline_at = time.monotonic() + self.deadline(agent)
+        attempt = 0
+        while True:
+            chosen = self.choose_model(model)
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{agent} 调用超过 {self.deadline(agent)}s 时限")
+            if span is not None:
+                span.model = chosen
+            started = time.monotonic()
+            try:
+                if self.hedge is not None:
+                    result, hedged = self.hedge.run(agent, lambda: attempt_fn(chosen, remaining), remaining)
+                    if span is not None and hedged:
+                        span.hedged = True
+                else:
+                    result = attempt_fn(chosen, remaining)
+            except Exception as e:
+                self.record(chosen, e)
+                delay = self.next_delay(attempt, e, deadline_at)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                if span is not None:
+                    span.retries += 1
+                continue
+            except BaseException:
+                self.release(chosen)
+                raise
+            self.record(chosen)
+            if self.hedge is not None:
+                self.hedge.observe(agent, time.monotonic() - started)
+            return result
@@ -0,0 +1,180 @@
+"""按 Agent 的模型路由：每个 Agent 对应 (模型, temperature, max_tokens)，可选按近期延迟/错误率与每场会话的
+费用预算在大小两个模型之间动态选择。每次调用的路由结果记录在 span 的 model / route 字段中。
+
+环境变量:
+    MIND_ROUTES="devil=gpt-4o-mini:0.7:120,guide=gpt-4o:0.7:600"   覆盖路由表，格式 agent=模型[:temperature[:max_tokens]]
+    MIND_ROUTING=static|dynamic (默认 static)
+    MIND_SMALL_MODEL=gpt-4o-mini   MIND_LARGE_MODEL=gpt-4o   动态策略中的小/大模型
+    MIND_SESSION_BUDGET_USD=0.05   每场会话的费用预算，用掉 80% 后只用小模型
+    MIND_LATENCY_SLO="guide=6,strategist=6"   各 Agent 的 p95 延迟目标 (秒)，大模型超出时改用小模型
+"""
+import os
+import random
+import threading
+from collections import OrderedDict, deque
+
+SMALL_MODEL = "gpt-4o-mini"
+LARGE_MODEL = "gpt-4o"
+
+
+class Route:
+    __slots__ = ("model", "temperature", "max_tokens")
+
+    def __init__(self, model, temperature=0.7, max_tokens=None):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    def __repr__(self):
+        return f"Route({self.model!r}, {self.temperature!r}, {self.max_tokens!r})"
+
+
+# Devil (≤30 字) 与 Trigger (≤150 字) 输出短、格式简单，默认走小模型；Guide / Strategist 需要严谨的 JSON，走大模型。
+# max_tokens 按各 Agent 输出上限留出余量 (中文约 1 token/字，trigger_i 另有思考过程)。
+DEFAULT_ROUTES = {
+    # trigger_i 先输出思考过程再输出 `Scene:`：约 500 字的思考过程 + 150 字场景按 estimate_tokens 约 650 token，留出余量
+    "trigger": Route(SMALL_MODEL, 0.7, 800),
+    "devil": Route(SMALL_MODEL, 0.7, 120),
+    "guide": Route(LARGE_MODEL, 0.7, 600),
+    "strategist": Route(LARGE_MODEL, 0.7, 400),
+    "scene-thought": Route(SMALL_MODEL, 0.7, 500),
+    "guide-strategist": Route(LARGE_MODEL, 0.7, 900),
+    "player": Route(SMALL_MODEL, 0.7, 150),
+}
+DEFAULT_LATENCY_SLO = {"trigger": 4.0, "devil": 3.0, "guide": 6.0, "strategist": 6.0,
+                       "scene-thought": 6.0, "guide-strategist": 8.0}
+
+
+def parse_routes(spec):
+    """解析 "devil=gpt-4o-mini:0.7:120,guide=gpt-4o" 形式的路由覆盖。"""
+    routes = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        agent, value = (part.strip() for part in item.split("=", 1))
+        parts = value.split(":")
+        default = DEFAULT_ROUTES.get(agent, Route(LARGE_MODEL))
+        routes[agent] = Route(
+            parts[0] or default.model,
+            float(parts[1]) if len(parts) > 1 and parts[1] else default.temperature,
+            int(parts[2]) if len(parts) > 2 and parts[2] else default.max_tokens,
+        )
+    return routes
+
+
+def parse_seconds(spec):
+    values = {}
+    for item in spec.split(","):
+        if "=" in item:
+            agent, seconds = (part.strip() for part in item.split("=", 1))
+            values[agent] = float(seconds)
+    return values
+
+
+class ModelStats:
+    """(Agent, 模型) 最近 window 次调用的耗时与成败。"""
+    __slots__ = ("latencies", "outcomes")
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def p95(self):
+        if len(self.latencies) < 10:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def error_rate(self):
+        if len(self.outcomes) < 5:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+class Router:
+    """static: 直接查路由表；dynamic: 在 small_model / large_model 之间按以下顺序决策——
+    会话预算将尽 → 小模型；路由表中的模型近期错误率过高或 p95 超出延迟目标 → 另一个模型 (其自身状况良好时)；
+    否则按路由表。切走后仍以 probe_ratio 的概率把请求发给路由表中的模型，使其统计得以恢复。
+    route() 返回 (Route, 决策原因)。"""
+
+    def __init__(self, routes=None, dynamic=False, small_model=SMALL_MODEL, large_model=LARGE_MODEL,
+                 session_budget=None, latency_slo=None, max_error_rate=0.3, probe_ratio=0.05, window=50,
+                 max_sessions=10000, rng=None):
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self.dynamic = dynamic
+        self.small_model = small_model
+        self.large_model = large_model
+        self.session_budget = session_budget
+        self.latency_slo = {**DEFAULT_LATENCY_SLO, **(latency_slo or {})}
+        self.max_error_rate = max_error_rate
+        self.probe_ratio = probe_ratio
+        self.rng = rng or random.Random()
+        self.window = window
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._session_cost = OrderedDict()
+
+    @classmethod
+    def from_env(cls):
+        budget = os.getenv("MIND_SESSION_BUDGET_USD")
+        return cls(
+            parse_routes(os.getenv("MIND_ROUTES", "")),
+            dynamic=os.getenv("MIND_ROUTING", "static") == "dynamic",
+            small_model=os.getenv("MIND_SMALL_MODEL", SMALL_MODEL),
+            large_model=os.getenv("MIND_LARGE_MODEL", LARGE_MODEL),
+            session_budget=float(budget) if budget else None,
+            latency_slo=parse_seconds(os.getenv("MIND_LATENCY_SLO", "")),
+        )
+
+    def _stats_for(self, agent, model):
+        key = (agent, model)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ModelStats(self.window)
+        return stats
+
+    def _healthy(self, agent, model):
+        stats = self._stats_for(agent, model)
+        p95 = stats.p95()
+        slo = self.latency_slo.get(agent)
+        if stats.error_rate() > self.max_error_rate:
+            return False, "errors"
+        if slo is not None and p95 is not None and p95 > slo:
+            return False, "latency"
+        return True, None
+
+    def session_cost(self, session_id):
+        with self._lock:
+            return self._session_cost.get(session_id, 0.0)
+
+    def route(self, agent, session_id=None):
+        base = self.routes.get(agent) or Route(self.large_model)
+        if not self.dynamic:
+            return base, "static"
+        with self._lock:
+            spent = self._session_cost.get(session_id, 0.0) if session_id else 0.0
+            if self.session_budget is not None and spent >= 0.8 * self.session_budget:
+                return Route(self.small_model, base.temperature, base.max_tokens), "budget"
+            ok, reason = self._healthy(agent, base.model)
+            if ok:
+                return base, "table"
+            if self.rng.random() < self.probe_ratio:
+                return base, "probe"
+            other = self.small_model if base.model == self.large_model else self.large_model
+            if self._healthy(agent, other)[0]:
+                return Route(other, base.temperature, base.max_tokens), reason
+            return base, "table"
+
+    def observe(self, agent, model, seconds, ok, cost_usd=0.0, session_id=None):
+        """每次调用结束后回报耗时、成败与费用。"""
+        with self._lock:
+            stats = self._stats_for(agent, model)
+            stats.outcomes.append(ok)
+            if ok:
+                stats.latencies.append(seconds)
+            if session_id and cost_usd:
+                self._session_cost[session_id] = self._session_cost.get(session_id, 0.0) + cost_usd
+                self._session_cost.move_to_end(session_id)
+                while len(self._session_cost) > self.max_sessions:
+                    self._session_cost.popitem(last=False)
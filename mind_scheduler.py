@@ -0,0 +1,180 @@
+"""跨会话的公平请求调度：全局在途请求上限、按会话轮转的公平排队，交互式请求优先于后台任务。
+
+同一进程内的所有 Streamlit 会话 (以及在进程内运行的模拟) 共用一个调度器，一个重度用户或批量模拟
+不能再独占 API 配额。等待中的调用方可以通过 queue_listener 收到自己的排队位置。
+交互式请求持续占满名额时，后台请求每被连续插队 aging_limit 次就放行一个，不会无限期等待。
+
+环境变量:
+    MIND_MAX_INFLIGHT=16   全局同时在途的 API 请求上限
+    MIND_SCHEDULER_AGING=8   后台请求连续被交互式请求插队多少次后放行一个 (0 表示严格优先，后台请求可能一直等待)
+"""
+import contextvars
+import itertools
+import os
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+_queue_listener = contextvars.ContextVar("mind_queue_listener", default=None)
+
+
+@contextmanager
+def queue_listener(callback):
+    """在此范围内发出的请求排队时，以 callback(position) 报告前面还有多少个请求；获得执行权时报告 0。"""
+    token = _queue_listener.set(callback)
+    try:
+        yield
+    finally:
+        _queue_listener.reset(token)
+
+
+class _Ticket:
+    __slots__ = ("session_id", "priority", "seq", "granted")
+
+    def __init__(self, session_id, priority, seq):
+        self.session_id = session_id
+        self.priority = priority
+        self.seq = seq
+        self.granted = False
+
+
+class FairScheduler:
+    """每个优先级内按会话轮转 (round-robin)：每次放行排在最前的会话的最早请求，然后把该会话移到队尾。
+    优先级之间交互式优先，但后台请求等待期间每放行 aging_limit 个交互式请求，就插入一个后台请求。"""
+
+    def __init__(self, max_inflight=16, poll_interval=0.5, aging_limit=8):
+        self.max_inflight = max_inflight
+        self.poll_interval = poll_interval
+        self.aging_limit = aging_limit
+        self._skipped = 0 # 后台请求等待期间连续放行的交互式请求数
+        self._cond = threading.Condition()
+        self._inflight = 0
+        # priority -> OrderedDict(session_id -> deque[_Ticket])
+        self._queues = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self._seq = itertools.count()
+        self.granted = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.queued = {INTERACTIVE: 0, BACKGROUND: 0} # 需要排队才获得执行权的请求数
+        self.aged = 0 # 因等待过久而先于交互式请求放行的后台请求数
+
+    @classmethod
+    def from_env(cls):
+        return cls(int(os.getenv("MIND_MAX_INFLIGHT", "16")), aging_limit=int(os.getenv("MIND_SCHEDULER_AGING", "8")))
+
+    def _waiting(self):
+        return any(self._queues.values())
+
+    def _next_priority(self):
+        # 持有 _cond 时调用：下一个放行的优先级，没有等待的请求时返回 None
+        waiting = [priority for priority in sorted(self._queues) if self._queues[priority]]
+        if not waiting:
+            return None
+        if waiting[0] == INTERACTIVE and BACKGROUND in waiting and self.aging_limit and self._skipped >= self.aging_limit:
+            self.aged += 1
+            return BACKGROUND
+        return waiting[0]
+
+    def _dispatch(self):
+        # 持有 _cond 时调用：在容量范围内依次放行
+        while self._inflight < self.max_inflight:
+            priority = self._next_priority()
+            if priority is None:
+                return
+            sessions = self._queues[priority]
+            session_id, tickets = next(iter(sessions.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            ticket.granted = True
+            self._inflight += 1
+            self.granted[priority] += 1
+            if priority == INTERACTIVE and self._queues[BACKGROUND]:
+                self._skipped += 1
+            else:
+                self._skipped = 0
+            self._cond.notify_all()
+
+    def position(self, ticket):
+        """ticket 前面还有多少个请求会先于它获得执行权 (近似值)。"""
+        with self._cond:
+            return self._position(ticket)
+
+    def _position(self, ticket):
+        if ticket.granted:
+            return 0
+        ahead = sum(len(q) for p, sessions in self._queues.items() if p < ticket.priority for q in sessions.values())
+        sessions = self._queues[ticket.priority]
+        # 轮转顺序下，排在本会话之前的每个会话都会先放行一个请求，本会话内更早的请求也在前面
+        for session_id, tickets in sessions.items():
+            if session_id == ticket.session_id:
+                return ahead + sum(1 for t in tickets if t.seq < ticket.seq) * len(sessions) + 1
+            ahead += 1
+        return ahead + 1
+
+    @contextmanager
+    def slot(self, session_id=None, priority=INTERACTIVE):
+        """阻塞直到获得执行权；排队期间把位置报告给当前的 queue_listener (在锁外调用)。
+        等待或报告中抛出异常 (例如 Streamlit 的 rerun) 时撤回排队，已获得的执行权立即归还。"""
+        listener = _queue_listener.get()
+        with self._cond:
+            ticket = _Ticket(session_id, priority, next(self._seq))
+            if self._inflight < self.max_inflight and not self._waiting():
+                ticket.granted = True
+                self._inflight += 1
+                self.granted[priority] += 1
+            else:
+                self.queued[priority] += 1
+                self._queues[priority].setdefault(session_id, deque()).append(ticket)
+        try:
+            last_position = None
+            while True:
+                with self._cond:
+                    if not ticket.granted and last_position is not None:
+                        self._cond.wait(self.poll_interval if listener is not None else None)
+                    if ticket.granted:
+                        break
+                    position = self._position(ticket)
+                if listener is not None and position != last_position:
+                    listener(position)
+                last_position = position
+            if listener is not None and last_position is not None:
+                listener(0)
+        except BaseException:
+            with self._cond:
+                if ticket.granted:
+                    self._inflight -= 1
+                    self._dispatch()
+                else:
+                    self._withdraw(ticket)
+            raise
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                self._dispatch()
+
+    def _withdraw(self, ticket):
+        # 持有 _cond 时调用：把尚未放行的 ticket 移出队列
+        sessions = self._queues[ticket.priority]
+        tickets = sessions.get(ticket.session_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del sessions[ticket.session_id]
+
+    def stats(self):
+        with self._cond:
+            return {
+                "inflight": self._inflight,
+                "max_inflight": self.max_inflight,
+                "waiting": {PRIORITY_NAMES[p]: sum(len(q) for q in s.values()) for p, s in self._queues.items()},
+                "granted": {PRIORITY_NAMES[p]: n for p, n in self.granted.items()},
+                "queued": {PRIORITY_NAMES[p]: n for p, n in self.queued.items()},
+                "aged": self.aged,
+            }
@@ -0,0 +1,291 @@
+"""会话持久化：每轮结束与阶段切换时把会话状态写入存储 (默认 SQLite WAL)，由后台线程批量写入，
+不阻塞界面。服务重启或断线后凭恢复令牌 (URL 中的 ?resume=...) 重新加载会话；空闲会话的历史回合
+从内存中移出，再次访问时按需从存储读取。会话的其余状态 (SESSION_KEYS，几个短字段) 由 Streamlit 持有，
+IdleEvictor 不移出它们：断开的会话由 Streamlit 自行回收，之后凭令牌从存储恢复。
+
+存储后端只需实现 write_batch / load_session / load_rounds 三个方法，见 SQLiteSessionStore 与
+MemorySessionStore。
+
+环境变量:
+    MIND_SESSION_STORE=sqlite|memory|off (默认 sqlite)
+    MIND_SESSION_DB   SQLite 文件路径 (默认为本模块所在目录下的 .cache/sessions.sqlite3)
+    MIND_SESSION_FLUSH_INTERVAL=0.5   批量写入的最长等待秒数
+    MIND_SESSION_IDLE_SECONDS=900     会话空闲多久后把历史回合移出内存
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+import weakref
+
+from mind_history import HistoryLog, RoundRecord
+
+logger = logging.getLogger("mind")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SESSION_DB = os.path.join(BASE_DIR, ".cache", "sessions.sqlite3")
+
+
+def new_resume_token():
+    return secrets.token_urlsafe(16)
+
+
+class SQLiteSessionStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 同步只在检查点时 fsync，进程崩溃不丢数据
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY, token TEXT UNIQUE NOT NULL,"
+            " state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rounds ("
+            " session_id TEXT NOT NULL, idx INTEGER NOT NULL, data TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, idx)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def write_batch(self, states, rounds):
+        """states: {session_id: (token, state_json)}；rounds: {(session_id, idx): data_json}。在一个事务中写入。"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, token, state, updated) VALUES (?, ?, ?, ?)",
+                    [(sid, token, state, now) for sid, (token, state) in states.items()],
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO rounds (session_id, idx, data) VALUES (?, ?, ?)",
+                    [(sid, idx, data) for (sid, idx), data in rounds.items()],
+                )
+
+    def load_session(self, token):
+        """返回 (session_id, state, 已保存的回合数)；令牌不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT session_id, state FROM sessions WHERE token = ?", (token,)).fetchone()
+            if row is None:
+                return None
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM rounds WHERE session_id = ?", (row[0],)).fetchone()
+        return row[0], json.loads(row[1]), count
+
+    def load_rounds(self, session_id, start, stop):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM rounds WHERE session_id = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                (session_id, start, stop),
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+
+class MemorySessionStore:
+    """进程内存储：不跨重启，但仍可在断线后凭令牌恢复，也便于本地调试。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._tokens = {}
+        self._rounds = {}
+
+    def write_batch(self, states, rounds):
+        with self._lock:
+            for session_id, (token, state) in states.items():
+                self._sessions[session_id] = (token, state)
+                self._tokens[token] = session_id
+            for (session_id, idx), data in rounds.items():
+                self._rounds.setdefault(session_id, {})[idx] = data
+
+    def load_session(self, token):
+        with self._lock:
+            session_id = self._tokens.get(token)
+            if session_id is None:
+                return None
+            return session_id, json.loads(self._sessions[session_id][1]), len(self._rounds.get(session_id, {}))
+
+    def load_rounds(self, session_id, start, stop):
+        with self._lock:
+            rounds = self._rounds.get(session_id, {})
+            return [json.loads(rounds[i]) for i in range(start, stop) if i in rounds]
+
+
+class SessionPersister:
+    """写后 (write-behind) 持久化：save_* 只把写入放进队列，后台线程每 flush_interval 秒或攒够 max_batch 条
+    合并写入一次 (同一会话的状态只保留最新一份)。读取前先 flush，保证读到自己刚写的数据。
+    saved_rounds() 给出各会话从第一轮起连续写入成功的回合数，内存中只有这些回合可以移出；写入失败的回合留在内存中。"""
+
+    def __init__(self, store, flush_interval=0.5, max_batch=256):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._saved = {} # session_id -> 从第一轮起连续写入成功的回合数
+        self._written = {} # session_id -> 已写入、但前面还有未写入回合的下标
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="mind-session-writer", daemon=True).start()
+        atexit.register(self.flush, 5.0)
+
+    @classmethod
+    def from_env(cls):
+        mode = os.getenv("MIND_SESSION_STORE", "sqlite").lower()
+        if mode == "off":
+            return None
+        if mode == "memory":
+            store = MemorySessionStore()
+        else:
+            store = SQLiteSessionStore(os.getenv("MIND_SESSION_DB", DEFAULT_SESSION_DB))
+        return cls(store, float(os.getenv("MIND_SESSION_FLUSH_INTERVAL", "0.5")))
+
+    # 在调用方线程序列化，之后界面再修改这些对象也不影响已提交的写入
+    def save_state(self, session_id, token, state):
+        self._queue.put(("state", session_id, token, json.dumps(state, ensure_ascii=False)))
+
+    def save_round(self, session_id, index, record):
+        if isinstance(record, RoundRecord):
+            record = record.to_dict()
+        self._queue.put(("round", session_id, index, json.dumps(record, ensure_ascii=False)))
+
+    def flush(self, timeout=None):
+        """等待此前提交的写入全部落盘。"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch and not isinstance(batch[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        states, rounds, waiters = {}, {}, []
+        for item in batch:
+            if isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item[0] == "state":
+                _, session_id, token, state = item
+                states[session_id] = (token, state)
+            else:
+                _, session_id, index, record = item
+                rounds[(session_id, index)] = record
+        if states or rounds:
+            try:
+                self.store.write_batch(states, rounds)
+                self.batches += 1
+                self.writes += len(states) + len(rounds)
+                self._mark_saved(rounds)
+            except Exception as e: # 写入失败只影响恢复，不影响当前会话；这些回合不计入 saved_rounds，不会被移出内存
+                self.failures += 1
+                logger.error(f"会话持久化失败: {e}")
+        for waiter in waiters:
+            waiter.set()
+
+    def _mark_saved(self, rounds):
+        with self._lock:
+            for session_id, index in rounds:
+                self._written.setdefault(session_id, set()).add(index)
+            for session_id in {session_id for session_id, _ in rounds}:
+                written = self._written[session_id]
+                count = self._saved.get(session_id, 0)
+                while count in written:
+                    written.discard(count)
+                    count += 1
+                self._saved[session_id] = count
+
+    def saved_rounds(self, session_id):
+        """该会话从第一轮起已经连续写入存储的回合数。"""
+        with self._lock:
+            return self._saved.get(session_id, 0)
+
+    def resume(self, token, window=None):
+        """按令牌恢复会话：返回 (session_id, state, history)，history 的回合在首次访问时才从存储读取。"""
+        self.flush()
+        loaded = self.store.load_session(token)
+        if loaded is None:
+            return None
+        session_id, state, count = loaded
+        with self._lock:
+            self._saved[session_id] = max(self._saved.get(session_id, 0), count)
+        return session_id, state, HistoryLog.lazy(count, self.round_loader(session_id), window,
+                                                  lambda: self.saved_rounds(session_id))
+
+    def round_loader(self, session_id):
+        def load(start, stop):
+            self.flush()
+            return [RoundRecord.from_dict(data) for data in self.store.load_rounds(session_id, start, stop)]
+        return load
+
+
+class IdleEvictor:
+    """记录各会话最近一次活动；后台线程定期把空闲超过 idle_seconds 的会话的历史回合移出内存。
+    只处理历史回合这部分随轮数增长的状态；其余字段仍在 st.session_state 中，已随每次 checkpoint 写入存储。
+    写入失败、尚未落盘的回合由 HistoryLog.evict 留在内存中。"""
+
+    def __init__(self, persister, idle_seconds=900, interval=60):
+        self.persister = persister
+        self.idle_seconds = idle_seconds
+        self.interval = interval
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._sessions = {} # session_id -> (weakref(HistoryLog), last_active)
+        threading.Thread(target=self._run, name="mind-session-evictor", daemon=True).start()
+
+    @classmethod
+    def from_env(cls, persister):
+        return cls(persister, float(os.getenv("MIND_SESSION_IDLE_SECONDS", "900")))
+
+    def touch(self, session_id, history):
+        with self._lock:
+            self._sessions[session_id] = (weakref.ref(history), time.monotonic())
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [(sid, ref) for sid, (ref, last) in self._sessions.items() if now - last >= self.idle_seconds]
+            for sid, _ in idle:
+                del self._sessions[sid]
+        if not idle:
+            return 0
+        # 先等待已提交的写入完成；HistoryLog 只移出其中写入成功的回合
+        self.persister.flush()
+        evicted = 0
+        for _, ref in idle:
+            history = ref()
+            if history is not None:
+                evicted += history.evict()
+        self.evicted += evicted
+        return evicted
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"空闲会话清理失败: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,188 @@
+"""无界面批量模拟：并发运行多场完整 MIND 会话，输出每场会话的 history (JSONL)。
+
+担忧与主题取自 C2D2 数据集，安慰话语由脚本化玩家或 LLM 玩家生成。
+
+用法:
+    python mind_simulate.py --sessions 200 --concurrency 32 --rpm 500 --tpm 200000 --out sessions.jsonl
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from mind_c2d2 import C2D2Index
+from mind_cache import ResponseCache
+from mind_classifier import load_or_train
+from mind_engine import THEME_OPTIONS, SessionEngine, SessionState
+from mind_llm import DEFAULT_MODEL, LLM, make_client
+from mind_prompts import PromptTemplate
+from mind_ratelimit import RateLimiter
+from mind_resilience import ResiliencePolicy
+from mind_routing import Router
+from mind_scheduler import BACKGROUND, FairScheduler
+from mind_tracing import Tracer
+
+# C2D2 场景中的关键词 -> 主题；都不匹配时随机选一个主题
+THEME_KEYWORDS = [
+    ("工作问题 (Work issues)", ("工作", "老板", "上司", "同事", "加班", "公司", "领导", "项目")),
+    ("家庭问题 (Family issues)", ("妈妈", "爸爸", "父母", "家里", "孩子", "老公", "老婆", "家人")),
+    ("经济问题 (Economic issues)", ("钱", "工资", "房租", "贷款", "买不起", "花销")),
+    ("身体压力 (Physical stress)", ("生病", "头晕", "感冒", "身体", "医院", "失眠", "疼")),
+    ("人际关系问题 (Interpersonal issues)", ("朋友", "同学", "室友", "恋人", "男朋友", "女朋友", "聚会")),
+    ("理想与现实的差距 (Discrepancy between ideal and reality)", ("考试", "成绩", "梦想", "目标", "理想", "失败")),
+]
+
+SCRIPTED_COMFORTS = [
+    "我理解你现在的感受，但“{thought}”这个想法可能并不完全符合事实。",
+    "先别急着下结论，这件事有没有其他可能的解释？",
+    "你已经很努力了，一次的结果并不能说明全部。",
+    "如果是好朋友遇到同样的情况，你会怎么安慰对方？也试着这样对待自己吧。",
+    "情绪来了很正常，我们先照顾好自己，再一步一步想办法。",
+    "回想一下，过去你也克服过类似的困难，这次同样有机会。",
+]
+
+PLAYER_PROMPT = PromptTemplate("player", """
+你在扮演一位正在练习自我安慰的用户。
+任务：针对下方“内在自我”的想法，写一段温和、具体的回应或安慰 (Cᵢ)，帮助其进行认知重构。
+要求：
+1. 不超过60字，口语化。
+2. 直接输出安慰内容，不要任何前缀。
+
+--- 输入 ---
+当前场景: {scene}
+内在想法: {thoughts}
+""", budget=600)
+
+
+def infer_theme(text, rng):
+    for theme, keywords in THEME_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return theme
+    return rng.choice(THEME_OPTIONS)
+
+
+def sample_starts(index, n, rng):
+    """从 C2D2 中抽取 n 个 (theme, concern) 作为会话起点。"""
+    starts = []
+    for i in rng.sample(range(len(index)), min(n, len(index))):
+        record = index.record(i)
+        concern = f"{record['scene']} {record['thought']}"
+        starts.append((infer_theme(concern, rng), concern))
+    while len(starts) < n:
+        starts.append(rng.choice(starts))
+    return starts
+
+
+def scripted_player(rng):
+    lock = threading.Lock()
+
+    def player(state, current_data):
+        with lock:
+            template = rng.choice(SCRIPTED_COMFORTS)
+        return template.format(thought=current_data["devil_thoughts"])
+    return player
+
+
+def llm_player(llm):
+    def player(state, current_data):
+        variables = {"scene": current_data["scene"], "thoughts": current_data["devil_thoughts"]}
+        return (llm.call(PLAYER_PROMPT, variables, "你是正在练习自我安慰的用户") or "").strip()
+    return player
+
+
+def run_one(engine, player, theme, concern, max_rounds):
+    state = SessionState(theme, concern, session_id=uuid.uuid4().hex)
+    started = time.perf_counter()
+    error = None
+    try:
+        engine.run_session(state, player, max_rounds=max_rounds)
+    except Exception as e: # 单场会话失败不影响其余会话
+        error = repr(e)
+    ended_by = "max_rounds"
+    if error:
+        ended_by = "error"
+    elif state.finished:
+        ended_by = "convergence" if state.last_progression.get("convergence") else "is_end"
+    return {
+        "session_id": state.session_id,
+        "theme": theme,
+        "concern": concern,
+        "rounds": len(state.history),
+        "ended_by": ended_by,
+        "error": error,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "history": state.history.to_list(),
+    }
+
+
+def summarize(results, wall_seconds, limiter, tracer=None):
+    ended = [r for r in results if r["ended_by"] == "is_end"]
+    return {
+        "sessions": len(results),
+        "ended_by_is_end": len(ended),
+        "ended_by_convergence": sum(r["ended_by"] == "convergence" for r in results),
+        "ended_by_max_rounds": sum(r["ended_by"] == "max_rounds" for r in results),
+        "errors": sum(r["ended_by"] == "error" for r in results),
+        "mean_rounds_to_is_end": sum(r["rounds"] for r in ended) / len(ended) if ended else None,
+        "total_rounds": sum(r["rounds"] for r in results),
+        "wall_seconds": round(wall_seconds, 2),
+        "sessions_per_hour": round(len(results) / wall_seconds * 3600, 1) if wall_seconds else None,
+        "api_requests": limiter.granted_requests,
+        "estimated_tokens": limiter.granted_tokens,
+        "agents": tracer.aggregator.snapshot() if tracer and tracer.aggregator else None,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="并发运行 MIND 会话模拟")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的会话数")
+    parser.add_argument("--max-inflight", type=int, default=16, help="全局同时在途的 API 请求上限")
+    parser.add_argument("--rpm", type=float, default=500, help="每分钟请求数上限 (0 表示不限)")
+    parser.add_argument("--tpm", type=float, default=200000, help="每分钟 token 数上限 (0 表示不限)")
+    parser.add_argument("--max-rounds", type=int, default=8)
+    parser.add_argument("--player", choices=("scripted", "llm"), default="scripted")
+    parser.add_argument("--model", default=os.getenv("MIND_MODEL"), help="所有 Agent 统一使用的模型；不设置时按路由表 (MIND_ROUTES)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="sessions.jsonl")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+    rng = random.Random(args.seed)
+    index = C2D2Index.load()
+    limiter = RateLimiter(rpm=args.rpm or None, tpm=args.tpm or None)
+    # 模拟属于后台任务：与界面共用同一进程时，交互请求优先获得并发名额
+    scheduler = FairScheduler(max_inflight=args.max_inflight)
+    tracer = Tracer.from_env()
+    router = None if args.model else Router.from_env()
+    llm = LLM(make_client(), ResponseCache.from_env(), model=args.model or DEFAULT_MODEL, limiter=limiter, tracer=tracer,
+              resilience=ResiliencePolicy.from_env(), router=router, scheduler=scheduler, priority=BACKGROUND)
+    engine = SessionEngine(llm, index, load_or_train())
+    player = scripted_player(rng) if args.player == "scripted" else llm_player(llm)
+
+    starts = sample_starts(index, args.sessions, rng)
+    results = []
+    write_lock = threading.Lock()
+    started = time.perf_counter()
+    with open(args.out, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(run_one, engine, player, theme, concern, args.max_rounds) for theme, concern in starts]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+            print(f"[{done}/{len(futures)}] {result['ended_by']} 于第 {result['rounds']} 轮 ({result['elapsed_s']}s)", file=sys.stderr)
+
+    print(json.dumps(summarize(results, time.perf_counter() - started, limiter, tracer), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
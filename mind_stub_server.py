@@ -0,0 +1,257 @@
+"""本地 OpenAI 兼容的 /v1/chat/completions 替身服务，用于无成本的端到端测试与基准测试。
+
+按 system 消息识别 Trigger / Devil / Guide / Strategist，返回与各 Agent 输出格式一致的固定内容；
+支持流式 (SSE) 与 response_format=json_object，可配置首 token 延迟、逐块延迟、错误率，以及按比例返回
+格式有缺陷的 JSON (代码块标记、多余文字、截断、键名写法、缺少字段)，用于测量输出修复的效果。
+
+用法:
+    python mind_stub_server.py --port 8765 --ttft-ms 300 --chunk-ms 15 --error-rate 0.02 --malformed-rate 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub streamlit run mind_cn_web_demo.py
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCENES = [
+    "周一早上，你刚到公司就被叫进会议室，领导当着同事的面指出你上周报告里的几处错误。",
+    "晚上十点，你还在出租屋里改简历，手机里是第三封拒信，窗外的外卖电动车来来往往。",
+    "家庭聚餐时，亲戚们聊起表哥升职加薪的事，妈妈转头问你最近工作怎么样。",
+]
+THOUGHTS = [
+    "我总是把事情搞砸，大家肯定都觉得我没用。",
+    "再这样下去我这辈子都不会有出息了。",
+    "他们一定在背后笑话我。",
+]
+TYPES = ["过度泛化", "乱贴标签", "读心术", "算命", "非黑即白"]
+# 各模型相对于基准延迟的倍数，用于模拟小模型更快的首 token 与生成速度
+MODEL_SPEED = {"gpt-4o-mini": 0.5, "gpt-4.1-mini": 0.5}
+MALFORMATIONS = ("fence", "trailing_text", "truncate", "keys", "missing")
+
+
+class StubConfig:
+    def __init__(self, ttft_ms=200.0, ttft_sigma=0.4, chunk_ms=10.0, chunk_chars=4, error_rate=0.0,
+                 end_prob=0.15, seed=None, model_speed=None, malformed_rate=0.0):
+        self.ttft_ms = ttft_ms          # 首 token 延迟 (对数正态分布的中位数)
+        self.ttft_sigma = ttft_sigma    # 对数正态分布的 sigma
+        self.chunk_ms = chunk_ms        # 流式输出每块之间的延迟
+        self.chunk_chars = chunk_chars  # 每块字符数
+        self.error_rate = error_rate    # 按此概率返回 429/500
+        self.end_prob = end_prob        # Strategist 给出 is_end=Yes 的概率
+        self.malformed_rate = malformed_rate  # JSON 输出按此概率带上 MALFORMATIONS 中的一种缺陷
+        self.model_speed = MODEL_SPEED if model_speed is None else model_speed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def sample(self, fn, *args):
+        with self.lock:
+            return fn(self.rng, *args)
+
+
+def malform(payload, kind):
+    """把 JSON 输出改成模型常见的有缺陷形式；补问请求 (只含个别字段) 原样返回。"""
+    if kind == "missing":
+        # 去掉一个必填字段 (嵌套的规划中去掉思想演变指导)
+        payload = dict(payload)
+        if "memory_summary_curr" in payload:
+            del payload["memory_summary_curr"]
+        elif "progression_directives" in payload:
+            payload["progression_directives"] = {k: v for k, v in payload["progression_directives"].items()
+                                                 if k != "next_thought_directive"}
+        else:
+            payload.pop(next(iter(payload)))
+        return json.dumps(payload, ensure_ascii=False)
+    if kind == "keys":
+        camel = lambda key: key.split("_")[0] + "".join(part.capitalize() for part in key.split("_")[1:])
+        renamed = {camel(k): ({camel(kk): (vv == "Yes" if kk == "is_end" else vv) for kk, vv in v.items()}
+                              if isinstance(v, dict) else v) for k, v in payload.items()}
+        return json.dumps(renamed, ensure_ascii=False)
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    if kind == "fence":
+        return f"```json\n{text}\n```"
+    if kind == "trailing_text":
+        return f"好的，以下是输出：\n{text}\n希望对你有帮助。"
+    return text[:-3] # truncate：丢掉最后的引号与括号
+
+
+def canned_output(body, config):
+    """根据请求中的 system 角色生成与该 Agent 输出格式一致的内容。"""
+    messages = body.get("messages", [])
+    system = messages[0]["content"] if messages else ""
+    prompt = messages[-1]["content"] if messages else ""
+    pick = lambda options: config.sample(lambda rng: rng.choice(options))
+
+    guide = {
+        "guidance_suggestions": ["试着找找支持和反对这个想法的证据。", "想一想：如果是朋友遇到同样的事，你会怎么对对方说？"],
+        "memory_summary_curr": f"场景：{pick(SCENES)[:30]}；想法：{pick(THOUGHTS)}；类型：{pick(TYPES)}；情绪：焦虑、自责。",
+    }
+    ended = config.sample(lambda rng: rng.random() < config.end_prob)
+    strategist = {"progression_directives": {
+        "next_scene_directive": "延续当前情境，加入一个让主角重新审视自己的小事件",
+        "next_thought_directive": "尝试反思，但仍有部分扭曲",
+        "is_end": "Yes" if ended else "No",
+    }}
+    payload = None
+    # 合并调用模式 (MIND_PIPELINE=fused) 的两个角色
+    if "Guide" in system and "Strategist" in system:
+        payload = {**guide, **strategist}
+    elif "Trigger" in system and "Devil" in system:
+        payload = {"scene": pick(SCENES), "thoughts": pick(THOUGHTS), "type": pick(TYPES)}
+    elif "Guide" in system:
+        payload = guide
+    elif "Strategist" in system:
+        payload = strategist
+    if payload is not None:
+        if "缺少以下字段" in prompt:
+            # 定向补问：只返回被索要的字段
+            fields = {**payload, **payload.get("progression_directives", {})}
+            return json.dumps({k: v for k, v in fields.items() if k in prompt.split("\n", 2)[1]}, ensure_ascii=False)
+        kind = config.sample(lambda rng: rng.choice(MALFORMATIONS) if rng.random() < config.malformed_rate else None)
+        return malform(payload, kind) if kind else json.dumps(payload, ensure_ascii=False)
+    if "Trigger" in system:
+        scene = f"Scene: {pick(SCENES)}"
+        # trigger_i 要求先输出思考过程
+        return f"思考过程：根据策略师的指导延续情境。\n{scene}" if "(i-1)" in prompt else scene
+    if "Devil" in system:
+        thoughts = f"Thoughts: {pick(THOUGHTS)}"
+        return f"Type: {pick(TYPES)}\n{thoughts}" if "Type:" in prompt else thoughts
+    return "好的。"
+
+
+def estimate_usage(body, content):
+    prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+    return {"prompt_tokens": prompt_chars, "completion_tokens": len(content), "total_tokens": prompt_chars + len(content)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        # 客户端超时放弃或对冲请求落败时会提前断开连接，属于预期情况
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            failed = config.rng.random() < config.error_rate
+            status = config.rng.choice((429, 500, 503)) if failed else 200
+            speed = config.model_speed.get(body.get("model"), 1.0)
+            ttft = config.rng.lognormvariate(0, config.ttft_sigma) * config.ttft_ms * speed / 1000.0
+        time.sleep(ttft)
+        if failed:
+            self._send_json(status, {"error": {"message": f"stub injected error {status}", "type": "server_error"}})
+            return
+
+        content = canned_output(body, config)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o")
+        if not body.get("stream"):
+            # 非流式请求同样要等完整内容 "生成" 完毕
+            time.sleep(max(0, -(-len(content) // config.chunk_chars) - 1) * config.chunk_ms * speed / 1000.0)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": estimate_usage(body, content),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for i in range(0, len(content), config.chunk_chars):
+            if i:
+                time.sleep(config.chunk_ms * speed / 1000.0)
+            event({"content": content[i:i + config.chunk_chars]})
+        event({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                           "choices": [], "usage": estimate_usage(body, content)}
+            self.wfile.write(f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def make_server(config=None, host="127.0.0.1", port=0):
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """在后台线程启动替身服务，返回 (server, base_url)；port=0 时自动分配端口。"""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name="stub-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--ttft-sigma", type=float, default=0.4)
+    parser.add_argument("--chunk-ms", type=float, default=10.0)
+    parser.add_argument("--chunk-chars", type=int, default=4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--end-prob", type=float, default=0.15)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="JSON 输出带格式缺陷的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    config = StubConfig(args.ttft_ms, args.ttft_sigma, args.chunk_ms, args.chunk_chars, args.error_rate, args.end_prob,
+                        args.seed, malformed_rate=args.malformed_rate)
+    server = make_server(config, args.host, args.port)
+    print(f"替身服务已启动: http://{args.host}:{args.port}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
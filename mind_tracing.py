@@ -0,0 +1,297 @@
+"""Agent 调用追踪：每次 Trigger/Devil/Guide/Strategist 调用记录一个 span，写入滚动 JSONL 并汇总为分位数指标。
+
+span 字段：会话 id、轮次、Agent、模型及路由原因、prompt/completion token、耗时、首 token 延迟、缓存命中、
+重试次数、是否对冲、输出的本地修复、缺失字段补问、解析兜底、超出输入预算被裁剪的变量与费用。汇总结果可在侧边栏查看，也可通过 Prometheus 文本格式的 /metrics 端点抓取。
+
+环境变量:
+    MIND_TRACE=off|memory|jsonl (默认 jsonl)   MIND_TRACE_PATH   MIND_TRACE_MAX_BYTES   MIND_TRACE_BACKUPS
+    MIND_METRICS_PORT (设置后在该端口提供 /metrics)   MIND_METRICS_HOST=127.0.0.1 (需要外部抓取时设为 0.0.0.0)
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TRACE_PATH = os.path.join(BASE_DIR, ".cache", "traces", "spans.jsonl")
+AGENTS = ("trigger", "devil", "guide", "strategist", "scene-thought", "guide-strategist")
+QUANTILES = (0.5, 0.95, 0.99)
+# 每 100 万 token 的美元价格 (输入, 输出)；未列出的模型不计费用
+MODEL_PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+}
+
+_current_span = contextvars.ContextVar("mind_span", default=None)
+_trace_context = contextvars.ContextVar("mind_trace_context", default=(None, None))
+
+
+@contextmanager
+def trace_context(session_id, round_num):
+    """在此范围内创建的 span 自动带上会话 id 与轮次。"""
+    token = _trace_context.set((session_id, round_num))
+    try:
+        yield
+    finally:
+        _trace_context.reset(token)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+class Span:
+    __slots__ = ("session_id", "round", "agent", "template_id", "model", "route", "prompt_tokens", "completion_tokens",
+                 "usage_estimated", "wall_ms", "ttft_ms", "cache_hit", "retries", "hedged", "repairs", "field_retry",
+                 "parse_fallback", "trimmed", "missing_vars", "error", "started_at", "_t0")
+
+    def __init__(self, agent, template_id=None, session_id=None, round_num=None):
+        self.session_id = session_id
+        self.round = round_num
+        self.agent = agent
+        self.template_id = template_id
+        self.model = None
+        self.route = None # mind_routing 的决策原因：static / table / budget / latency / errors / probe
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.usage_estimated = False # 接口未返回 usage 时使用本地估算
+        self.wall_ms = None
+        self.ttft_ms = None
+        self.cache_hit = False
+        self.retries = 0
+        self.hedged = False
+        self.repairs = None # 本地修复的种类，例如 "trailing_text,braces,keys"
+        self.field_retry = None # 补问调用所索要的缺失字段
+        self.parse_fallback = None # 解析兜底的字段名，例如 "Scene" / "Thoughts" / "memory_summary_curr"
+        self.trimmed = None # 超出输入预算被截去中间部分的变量，例如 "c2d2_examples,comfort_prev"
+        self.missing_vars = None # 临时模板渲染时以 "信息缺失" 填充的变量
+        self.error = None
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+
+    def mark_first_token(self):
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.perf_counter() - self._t0) * 1000
+
+    def set_usage(self, usage, prompt_estimate=0, completion_estimate=0):
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens or 0
+            self.completion_tokens = usage.completion_tokens or 0
+        else:
+            self.prompt_tokens, self.completion_tokens = prompt_estimate, completion_estimate
+            self.usage_estimated = True
+
+    @property
+    def cost_usd(self):
+        if self.cache_hit or not self.model:
+            return 0.0
+        return estimate_cost(self.model, self.prompt_tokens, self.completion_tokens)
+
+    def finish(self):
+        self.wall_ms = (time.perf_counter() - self._t0) * 1000
+
+    def to_dict(self):
+        record = {name: getattr(self, name) for name in self.__slots__ if not name.startswith("_")}
+        record["cost_usd"] = self.cost_usd
+        return record
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class AgentStats:
+    __slots__ = ("calls", "errors", "cache_hits", "repairs", "field_retries", "parse_fallbacks", "trims", "retries",
+                 "hedges", "prompt_tokens", "completion_tokens", "cost_usd", "wall_ms", "ttft_ms")
+
+    def __init__(self, window):
+        self.calls = self.errors = self.cache_hits = self.parse_fallbacks = self.retries = self.hedges = 0
+        self.repairs = self.field_retries = self.trims = 0
+        self.prompt_tokens = self.completion_tokens = 0
+        self.cost_usd = 0.0
+        # 分位数只在最近 window 次调用上计算
+        self.wall_ms = deque(maxlen=window)
+        self.ttft_ms = deque(maxlen=window)
+
+
+class MetricsAggregator:
+    """进程内按 Agent 汇总 span；计数器为累计值，延迟分位数取最近 window 次调用。"""
+
+    def __init__(self, window=2048):
+        self.window = window
+        self._lock = threading.Lock()
+        self._agents = {}
+
+    def add(self, span):
+        with self._lock:
+            stats = self._agents.get(span.agent)
+            if stats is None:
+                stats = self._agents[span.agent] = AgentStats(self.window)
+            stats.calls += 1
+            stats.errors += span.error is not None
+            stats.cache_hits += span.cache_hit
+            stats.repairs += span.repairs is not None
+            stats.field_retries += span.field_retry is not None
+            stats.parse_fallbacks += span.parse_fallback is not None
+            stats.trims += span.trimmed is not None
+            stats.retries += span.retries
+            stats.hedges += span.hedged
+            stats.prompt_tokens += span.prompt_tokens
+            stats.completion_tokens += span.completion_tokens
+            stats.cost_usd += span.cost_usd or 0.0
+            if span.wall_ms is not None:
+                stats.wall_ms.append(span.wall_ms)
+            if span.ttft_ms is not None and not span.cache_hit:
+                stats.ttft_ms.append(span.ttft_ms)
+
+    def snapshot(self):
+        """返回 {agent: {计数器..., "wall_ms": {0.5: ..}, "ttft_ms": {..}}}，按 AGENTS 顺序排列。"""
+        with self._lock:
+            items = [(agent, stats, sorted(stats.wall_ms), sorted(stats.ttft_ms)) for agent, stats in self._agents.items()]
+        order = {agent: i for i, agent in enumerate(AGENTS)}
+        items.sort(key=lambda item: (order.get(item[0], len(order)), item[0]))
+        result = {}
+        for agent, stats, wall, ttft in items:
+            result[agent] = {
+                "calls": stats.calls, "errors": stats.errors, "cache_hits": stats.cache_hits,
+                "repairs": stats.repairs, "field_retries": stats.field_retries,
+                "parse_fallbacks": stats.parse_fallbacks, "trims": stats.trims, "retries": stats.retries,
+                "hedges": stats.hedges,
+                "prompt_tokens": stats.prompt_tokens, "completion_tokens": stats.completion_tokens,
+                "cost_usd": stats.cost_usd,
+                "wall_ms": {q: _percentile(wall, q) for q in QUANTILES} if wall else {},
+                "ttft_ms": {q: _percentile(ttft, q) for q in QUANTILES} if ttft else {},
+            }
+        return result
+
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{{{labels}}} {value}" for labels, value in samples)
+
+        counters = [
+            ("mind_agent_calls_total", "calls", "Agent 调用次数"),
+            ("mind_agent_errors_total", "errors", "调用失败次数"),
+            ("mind_agent_cache_hits_total", "cache_hits", "响应缓存命中次数"),
+            ("mind_agent_repairs_total", "repairs", "输出经本地修复的次数"),
+            ("mind_agent_field_retries_total", "field_retries", "缺失字段补问次数"),
+            ("mind_agent_parse_fallbacks_total", "parse_fallbacks", "输出解析兜底次数"),
+            ("mind_agent_prompt_trims_total", "trims", "输入超出预算被裁剪的次数"),
+            ("mind_agent_retries_total", "retries", "请求重试次数"),
+            ("mind_agent_hedges_total", "hedges", "对冲请求次数"),
+            ("mind_agent_cost_usd_total", "cost_usd", "估算费用 (美元)"),
+        ]
+        for name, key, help_text in counters:
+            family(name, "counter", help_text, [(f'agent="{a}"', s[key]) for a, s in snapshot.items()])
+        family("mind_agent_tokens_total", "counter", "token 用量", [
+            (f'agent="{a}",kind="{kind}"', s[f"{kind}_tokens"]) for a, s in snapshot.items() for kind in ("prompt", "completion")])
+        for key, help_text in (("wall_ms", "调用耗时 (毫秒)"), ("ttft_ms", "首 token 延迟 (毫秒)")):
+            family(f"mind_agent_{key}", "summary", help_text, [
+                (f'agent="{a}",quantile="{q}"', round(v, 3)) for a, s in snapshot.items() for q, v in s[key].items()])
+        return "\n".join(lines) + "\n"
+
+
+def jsonl_logger(path, max_bytes, backups):
+    """span 写入专用 logger，由 RotatingFileHandler 按大小滚动。"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    span_logger = logging.getLogger(f"mind.spans.{path}")
+    span_logger.propagate = False
+    span_logger.setLevel(logging.INFO)
+    if not span_logger.handlers:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        span_logger.addHandler(handler)
+    return span_logger
+
+
+class Tracer:
+    """创建并分发 span；aggregator / sink 均可为 None (此时 span 只在调用方可见)。"""
+
+    def __init__(self, aggregator=None, sink=None):
+        self.aggregator = aggregator
+        self.sink = sink
+
+    @classmethod
+    def from_env(cls):
+        mode = os.getenv("MIND_TRACE", "jsonl").lower()
+        if mode == "off":
+            return cls()
+        sink = None
+        if mode == "jsonl":
+            sink = jsonl_logger(
+                os.getenv("MIND_TRACE_PATH", DEFAULT_TRACE_PATH),
+                int(os.getenv("MIND_TRACE_MAX_BYTES", str(20 * 1024 * 1024))),
+                int(os.getenv("MIND_TRACE_BACKUPS", "5")),
+            )
+        return cls(MetricsAggregator(), sink)
+
+    def start(self, agent, template_id=None):
+        session_id, round_num = _trace_context.get()
+        return Span(agent, template_id, session_id, round_num)
+
+    def emit(self, span):
+        span.finish()
+        if self.aggregator is not None:
+            self.aggregator.add(span)
+        if self.sink is not None:
+            self.sink.info(json.dumps(span.to_dict(), ensure_ascii=False))
+
+    @contextmanager
+    def span(self, agent, template_id=None):
+        """在此范围内的 LLM.call 把调用信息写入同一个 span，调用方可再补充解析兜底等信息。"""
+        span = self.start(agent, template_id)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = span.error or repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.emit(span)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    aggregator = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        data = self.aggregator.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(aggregator, port, host="127.0.0.1"):
+    """在后台线程提供 Prometheus 文本格式的 /metrics；默认只监听本机，指标中的会话与费用信息不对外暴露。"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"aggregator": aggregator})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mind-metrics", daemon=True).start()
+    return server
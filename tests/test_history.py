@@ -0,0 +1,96 @@
+import pytest
+
+from mind_history import HistoryLog, RoundRecord
+
+
+def rounds(n, start=1):
+    return [{"round": i, "scene": f"s{i}"} for i in range(start, start + n)]
+
+
+class Store:
+    """按下标保存回合的 loader；saved 为从第一轮起已保存的回合数。"""
+
+    def __init__(self):
+        self.records = {}
+        self.calls = []
+
+    def save(self, index, record):
+        self.records[index] = record
+
+    def saved(self):
+        count = 0
+        while count in self.records:
+            count += 1
+        return count
+
+    def load(self, start, stop):
+        self.calls.append((start, stop))
+        return [self.records[i] for i in range(start, stop) if i in self.records]
+
+
+def logged(window, store, n):
+    log = HistoryLog(window=window, loader=store.load, saved=store.saved)
+    for data in rounds(n):
+        store.save(len(log), log.append(data))
+    return log
+
+
+def test_without_loader_every_round_stays_in_memory():
+    log = HistoryLog(rounds(10), window=3)
+    assert len(log) == 10
+    assert [r.round for r in log] == list(range(1, 11))
+    assert log.evict() == 0
+    assert log[0]["scene"] == "s1"
+
+
+def test_records_support_key_access():
+    record = HistoryLog(rounds(1))[-1]
+    assert isinstance(record, RoundRecord)
+    assert record["scene"] == "s1" and record.get("theme", "无") == "无"
+    with pytest.raises(KeyError):
+        record["missing"]
+    assert RoundRecord.from_dict(record.to_dict()).scene == "s1"
+
+
+def test_window_keeps_recent_rounds_and_pages_older_ones_from_the_loader():
+    store = Store()
+    log = logged(3, store, 8)
+    assert len(log) == 8
+    assert [r.round for r in log.page(2, 6)] == [3, 4, 5, 6]
+    assert store.calls == [(2, 5)] # 只有窗口之外的部分向 loader 读取
+    assert [r.round for r in log[-2:]] == [7, 8]
+    assert log[-1].round == 8
+    with pytest.raises(IndexError):
+        log[8]
+
+
+def test_evict_moves_saved_rounds_out_and_reads_them_back():
+    store = Store()
+    log = logged(10, store, 4)
+    assert log.evict() == 4
+    assert len(log) == 4 and bool(log)
+    assert log[-1].round == 4
+    assert [r.round for r in log] == [1, 2, 3, 4]
+
+
+def test_unsaved_rounds_are_never_evicted():
+    store = Store()
+    log = HistoryLog(window=2, loader=store.load, saved=store.saved)
+    for i, data in enumerate(rounds(5)):
+        record = log.append(data)
+        if i != 2: # 第 3 轮写入失败
+            store.save(i, record)
+    assert store.saved() == 2
+    assert log.evict() == 0 # 前两轮已经按窗口移出，第 3 轮起都必须留在内存中
+    assert [r.round for r in log] == [1, 2, 3, 4, 5]
+
+
+def test_lazy_log_loads_resumed_rounds_on_demand():
+    store = Store()
+    for i, data in enumerate(rounds(5)):
+        store.save(i, RoundRecord.from_dict(data))
+    log = HistoryLog.lazy(5, store.load, window=3, saved=store.saved)
+    assert len(log) == 5 and not store.calls
+    assert log[-1].round == 5
+    store.save(5, log.append(rounds(1, start=6)[0]))
+    assert [r.round for r in log] == [1, 2, 3, 4, 5, 6]
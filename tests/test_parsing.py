@@ -0,0 +1,143 @@
+import pytest
+
+from mind_parsing import (
+    GUIDE_SCHEMA, GUIDE_STRATEGIST_SCHEMA, STRATEGIST_SCHEMA, IncrementalJSONArray, canonical_key, parse_output,
+    partial_field, repair_json,
+)
+
+
+def test_valid_json_is_returned_without_repairs():
+    assert repair_json('{"a": 1}') == ({"a": 1}, [])
+
+
+def test_code_fence_and_surrounding_text_are_stripped():
+    data, repairs = repair_json('好的，输出如下：\n```json\n{"a": "x"}\n```\n希望有帮助')
+    assert data == {"a": "x"}
+    assert "leading_text" in repairs
+
+
+def test_fence_only():
+    data, repairs = repair_json('```json\n{"a": [1, 2]}\n```')
+    assert data == {"a": [1, 2]}
+    assert repairs == ["fence"]
+
+
+def test_trailing_commas_are_removed():
+    data, repairs = repair_json('{"a": [1, 2,], "b": "x",}')
+    assert data == {"a": [1, 2], "b": "x"}
+    assert "trailing_comma" in repairs
+
+
+def test_truncated_string_and_braces_are_closed():
+    data, repairs = repair_json('{"memory_summary_curr": "场景：加班到深夜')
+    assert data == {"memory_summary_curr": "场景：加班到深夜"}
+    assert "braces" in repairs
+
+
+def test_truncation_after_a_key_drops_the_dangling_pair():
+    data, _ = repair_json('{"a": "x", "b":')
+    assert data == {"a": "x"}
+
+
+def test_truncation_inside_an_array_keeps_complete_items():
+    data, _ = repair_json('{"guidance_suggestions": ["先共情", "再提问"')
+    assert data == {"guidance_suggestions": ["先共情", "再提问"]}
+
+
+def test_unrecoverable_text_returns_none():
+    assert repair_json("完全不是 JSON")[0] is None
+    assert repair_json(None) == (None, [])
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("memorySummaryCurr", "memory_summary_curr"),
+    ("Memory-Summary", "memory_summary"),
+    (" is end ", "is_end"),
+])
+def test_canonical_key(key, expected):
+    assert canonical_key(key) == expected
+
+
+def test_camel_case_and_alias_keys_map_to_schema_fields():
+    parsed = GUIDE_SCHEMA.parse('{"guidanceSuggestions": ["建议"], "memory": "总结"}')
+    assert parsed.ok
+    assert parsed.values == {"guidance_suggestions": ["建议"], "memory_summary_curr": "总结"}
+    assert "keys" in parsed.repairs
+
+
+def test_list_field_accepts_a_bulleted_string():
+    parsed = GUIDE_SCHEMA.parse('{"guidance_suggestions": "1. 先共情\\n- 再提问", "memory_summary_curr": "m"}')
+    assert parsed.values["guidance_suggestions"] == ["先共情", "再提问"]
+
+
+def test_nested_progression_directives_are_flattened():
+    raw = '{"progression_directives": {"next_scene_directive": "s", "next_thought_directive": "t", "is_end": "No"}}'
+    parsed = STRATEGIST_SCHEMA.parse(raw)
+    assert parsed.ok
+    assert parsed.values["is_end"] == "No"
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Yes", "Yes"),
+    ("yes.", "Yes"),
+    ("**Yes**", "Yes"),
+    ("Yes, 可以结束", "Yes"),
+    ("是的", "Yes"),
+    ("结束", "Yes"),
+    (True, "Yes"),
+    ("No", "No"),
+    (False, "No"),
+    ("否", "No"),
+    ("不结束", "No"),
+    ("暂时不", "No"),
+    ("结束为时尚早", "No"),
+    ("还不能结束", "No"),
+    ("继续", "No"),
+    ("No, 继续", "No"),
+    ("Yes, but not yet", "No"),
+    ("Yes because the user has recovered", None),
+    ("可以", None),
+    ("", None),
+])
+def test_is_end_polarity(value, expected):
+    assert STRATEGIST_SCHEMA.field("is_end").coerce(value)[0] == expected
+
+
+def test_missing_is_end_defaults_to_no_but_unreadable_is_end_is_missing():
+    base = '"next_scene_directive": "s", "next_thought_directive": "t"'
+    parsed = STRATEGIST_SCHEMA.parse("{" + base + "}")
+    assert parsed.ok and parsed.values["is_end"] == "No"
+    parsed = STRATEGIST_SCHEMA.parse("{" + base + ', "is_end": "看情况"}')
+    assert parsed.missing == ("is_end",)
+
+
+def test_error_payload_reports_every_required_field_missing():
+    parsed = GUIDE_STRATEGIST_SCHEMA.parse('{"error": "timeout"}')
+    assert set(parsed.missing) == {"guidance_suggestions", "memory_summary_curr", "next_scene_directive",
+                                   "next_thought_directive"}
+
+
+def test_merge_fills_only_the_missing_fields():
+    first = GUIDE_SCHEMA.parse('{"guidance_suggestions": ["a"]}')
+    second = GUIDE_SCHEMA.parse('{"guidance_suggestions": ["b"], "memory_summary_curr": "m"}')
+    merged = first.merge(second)
+    assert merged.ok
+    assert merged.values == {"guidance_suggestions": ["a"], "memory_summary_curr": "m"}
+
+
+@pytest.mark.parametrize("text", ["Scene: 深夜的办公室", "**Scene**：深夜的办公室", "思考过程：略\nScene：深夜的办公室"])
+def test_partial_and_final_key_parsing_agree(text):
+    assert partial_field(text, "Scene") == parse_output(text, "Scene") == "深夜的办公室"
+
+
+def test_partial_field_stops_at_the_next_key():
+    assert partial_field("Type: 读心术\nThoughts: 他们", "Type") == "读心术"
+
+
+def test_incremental_json_array_yields_items_as_they_close():
+    stream = IncrementalJSONArray("guidance_suggestions")
+    assert stream.feed('{"guidance_suggestions": ["先共') == []
+    assert stream.partial() == "先共"
+    assert stream.feed('情", "再') == ["先共情"]
+    assert stream.feed('提问"], "memory_summary_curr": "x"}') == ["再提问"]
+    assert stream.items == ["先共情", "再提问"]
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from mind_scheduler import BACKGROUND, INTERACTIVE, FairScheduler, queue_listener
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def waiting(scheduler):
+    return sum(scheduler.stats()["waiting"].values())
+
+
+def run_queued(scheduler, requests):
+    """占住唯一的名额，按 requests 的顺序依次排队，再放开名额，返回获得执行权的顺序。"""
+    order, lock, threads = [], threading.Lock(), []
+
+    def worker(session_id, priority, tag):
+        with scheduler.slot(session_id, priority):
+            with lock:
+                order.append(tag)
+
+    with scheduler.slot("holder"):
+        for i, (session_id, priority, tag) in enumerate(requests):
+            thread = threading.Thread(target=worker, args=(session_id, priority, tag))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: waiting(scheduler) == i + 1)
+    for thread in threads:
+        thread.join(2.0)
+    return order
+
+
+def test_sessions_take_turns():
+    scheduler = FairScheduler(max_inflight=1)
+    order = run_queued(scheduler, [("a", INTERACTIVE, "a1"), ("a", INTERACTIVE, "a2"), ("a", INTERACTIVE, "a3"),
+                                   ("b", INTERACTIVE, "b1"), ("c", INTERACTIVE, "c1")])
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_interactive_requests_go_before_background():
+    scheduler = FairScheduler(max_inflight=1, aging_limit=0)
+    order = run_queued(scheduler, [("sim", BACKGROUND, "bg"), ("u1", INTERACTIVE, "i1"), ("u2", INTERACTIVE, "i2")])
+    assert order == ["i1", "i2", "bg"]
+
+
+def test_background_requests_age_past_interactive_load():
+    scheduler = FairScheduler(max_inflight=1, aging_limit=2)
+    requests = [("sim", BACKGROUND, "b1"), ("sim", BACKGROUND, "b2")]
+    requests += [(f"u{i}", INTERACTIVE, f"i{i}") for i in range(5)]
+    order = run_queued(scheduler, requests)
+    assert order == ["i0", "i1", "b1", "i2", "i3", "b2", "i4"]
+    assert scheduler.stats()["aged"] == 2
+
+
+def test_position_is_reported_while_queued_and_zero_when_granted():
+    scheduler = FairScheduler(max_inflight=1, poll_interval=0.01)
+    positions = []
+    done = threading.Event()
+
+    def worker():
+        with queue_listener(positions.append), scheduler.slot("b"):
+            done.set()
+
+    with scheduler.slot("a"):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        wait_until(lambda: positions)
+    thread.join(2.0)
+    assert done.is_set()
+    assert positions[0] == 1 and positions[-1] == 0
+
+
+def test_queued_ticket_is_withdrawn_when_the_listener_raises():
+    scheduler = FairScheduler(max_inflight=1)
+
+    def interrupt(position):
+        raise KeyboardInterrupt # 例如 Streamlit rerun 打断排队中的脚本线程
+
+    with scheduler.slot("a"):
+        with pytest.raises(KeyboardInterrupt), queue_listener(interrupt), scheduler.slot("b"):
+            pass
+        assert waiting(scheduler) == 0
+    assert scheduler.stats()["inflight"] == 0
+    with scheduler.slot("c"):
+        assert scheduler.stats()["inflight"] == 1
+
+
+def test_granted_slot_is_released_when_reporting_the_grant_raises():
+    scheduler = FairScheduler(max_inflight=1, poll_interval=0.01)
+    errors = []
+
+    def listener(position):
+        if position == 0:
+            raise RuntimeError("rerun")
+
+    def worker():
+        try:
+            with queue_listener(listener), scheduler.slot("b"):
+                pass
+        except RuntimeError as e:
+            errors.append(e)
+
+    with scheduler.slot("a"):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        wait_until(lambda: waiting(scheduler) == 1)
+    thread.join(2.0)
+    assert len(errors) == 1
+    assert scheduler.stats()["inflight"] == 0
+
+
+def test_slot_is_released_when_the_body_raises():
+    scheduler = FairScheduler(max_inflight=1)
+    with pytest.raises(ValueError), scheduler.slot("a"):
+        raise ValueError
+    assert scheduler.stats()["inflight"] == 0
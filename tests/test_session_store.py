@@ -0,0 +1,79 @@
+import pytest
+
+from mind_history import HistoryLog
+from mind_session_store import IdleEvictor, MemorySessionStore, SessionPersister, SQLiteSessionStore, new_resume_token
+
+
+class FlakyStore(MemorySessionStore):
+    fail = False
+
+    def write_batch(self, states, rounds):
+        if self.fail:
+            raise OSError("disk full")
+        super().write_batch(states, rounds)
+
+
+def play(persister, session_id, token, count, window=64):
+    history = HistoryLog(window=window, loader=persister.round_loader(session_id),
+                         saved=lambda: persister.saved_rounds(session_id))
+    for i in range(count):
+        record = history.append({"round": i + 1, "scene": f"s{i + 1}", "guide_suggestions": ["g"]})
+        persister.save_round(session_id, i, record)
+        persister.save_state(session_id, token, {"stage": "waiting_comfort", "current_round": i + 1})
+    return history
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_resume_round_trip(store):
+    persister = SessionPersister(store, flush_interval=0.01)
+    token = new_resume_token()
+    play(persister, "s1", token, 3)
+    session_id, state, history = persister.resume(token, window=2)
+    assert session_id == "s1"
+    assert state == {"stage": "waiting_comfort", "current_round": 3} # 同一会话只保留最新状态
+    assert len(history) == 3
+    assert history[-1]["scene"] == "s3"
+    assert [r.round for r in history] == [1, 2, 3]
+    assert list(history[0].guide_suggestions) == ["g"]
+    assert persister.saved_rounds("s1") == 3
+
+
+def test_unknown_token_does_not_resume(store):
+    assert SessionPersister(store, flush_interval=0.01).resume("nope") is None
+
+
+def test_resumed_history_keeps_growing(store):
+    persister = SessionPersister(store, flush_interval=0.01)
+    token = new_resume_token()
+    play(persister, "s1", token, 2)
+    _, _, history = persister.resume(token, window=2)
+    record = history.append({"round": 3, "scene": "s3"})
+    persister.save_round("s1", 2, record)
+    persister.flush()
+    _, _, again = persister.resume(token)
+    assert [r.round for r in again] == [1, 2, 3]
+
+
+def test_failed_writes_are_not_counted_or_evicted():
+    store = FlakyStore()
+    persister = SessionPersister(store, flush_interval=0.01)
+    history = play(persister, "s1", "t", 2)
+    persister.flush()
+    store.fail = True
+    record = history.append({"round": 3, "scene": "s3"})
+    persister.save_round("s1", 2, record)
+    persister.flush()
+    assert persister.failures == 1
+    assert persister.saved_rounds("s1") == 2
+
+    evictor = IdleEvictor(persister, idle_seconds=0, interval=3600)
+    evictor.touch("s1", history)
+    assert evictor.sweep() == 2 # 只移出写入成功的前两轮
+    assert len(history) == 3
+    assert [r.round for r in history] == [1, 2, 3]